@@ -0,0 +1,465 @@
+"""Benchmark da biblioteca com dados sinteticos.
+
+Gera bancos e CSVs de tamanhos diferentes e mede os caminhos reais do
+programa (consultas da lista, importacao, exportacao, salvar/remover e o
+preenchimento do Treeview). O resultado vai para um JSON, para comparar
+commits:
+
+    python benchmark.py --tamanhos 10000 100000 --saida antes.json
+
+Roda sem tela: sem DISPLAY o Treeview e trocado por um objeto que so
+registra as chamadas. Os arquivos gerados ficam em --dir e sao reaproveitados
+entre execucoes com os mesmos parametros.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import accumulate, islice
+
+import biblioteca_dados as dados
+from biblioteca_dados import (
+    GENEROS, INSERT_LIVRO, TAMANHO_LOTE, TAMANHO_PAGINA, Consulta,
+    ListaLivros, RepositorioLivros, chave_livro, em_lotes, fechar_conexao,
+)
+
+TAMANHOS = (10_000, 100_000, 1_000_000, 5_000_000)
+CASOS    = ("consultas", "escrita", "csv", "treeview", "memoria")
+
+# ── Dados sinteticos ──────────────────────────────────────────────────────────
+
+PALAVRAS = (
+    "amor guerra mar noite sol tempo cidade vento sombra casa rio caminho "
+    "segredo ilha memoria fogo luz terra silencio jardim estrela cinzas "
+    "montanha destino sangue inverno lobo espelho porta relogio labirinto "
+    "viagem ultimo primeiro perdido eterno invisivel proibido azul negro "
+    "antigo selvagem distante quebrado dourado"
+).split()
+NOMES = (
+    "Ana Joao Maria Jose Clarice Jorge Cecilia Carlos Rachel Graciliano "
+    "Lygia Mario Conceicao Erico Hilda Rubem Adelia Fernando Nelida Raduan "
+    "Isabel Gabriel Ursula Haruki Chimamanda Italo Virginia Franz Toni Jose"
+).split()
+SOBRENOMES = (
+    "Silva Santos Oliveira Souza Lispector Amado Meireles Drummond Queiroz "
+    "Ramos Telles Andrade Evaristo Verissimo Hilst Fonseca Prado Pessoa "
+    "Pinon Nassar Allende Marquez LeGuin Murakami Adichie Calvino Woolf "
+    "Kafka Morrison Saramago Rosa Machado Alencar Azevedo Bandeira"
+).split()
+EDITORAS = ("Companhia das Letras", "Record", "Rocco", "Intrinseca", "Globo",
+            "Aleph", "Darkside", "Todavia", "Sextante", "Zahar", None)
+# Como o genero costuma vir escrito num CSV de outro programa
+GENEROS_CSV = {g: [g, g.lower()] for g in GENEROS}
+for _sinonimo, _genero in dados.SINONIMOS_GENERO.items():
+    GENEROS_CSV[_genero].append(_sinonimo.title())
+
+
+def _zipf(n, s=1.1):
+    """Pesos 1/k^s: poucos itens muito frequentes, cauda longa."""
+    return [1 / (k ** s) for k in range(1, n + 1)]
+
+
+def livros_sinteticos(n, duplicatas=0.0, seed=0):
+    """Gera `n` livros (titulo, autor, genero, ano, editora, lido, nota, obs).
+
+    Autores e generos seguem distribuicoes de cauda longa. Uma fracao
+    `duplicatas` das linhas repete titulo e autor de uma linha anterior, com
+    caixa ou espacos alterados para passar pela normalizacao da
+    chave. A sequencia depende so de `seed`.
+    """
+    rng = random.Random(seed)
+    autores = ["{} {}".format(rng.choice(NOMES), rng.choice(SOBRENOMES))
+               for _ in range(max(n // 20, 50))]
+    # Pesos acumulados uma vez: com weights= o choices() refaria a soma a
+    # cada linha, e o custo cresceria com n * autores
+    acum_autor  = list(accumulate(_zipf(len(autores))))
+    acum_genero = list(accumulate(_zipf(len(GENEROS), 0.8)))
+    recentes = []   # titulo/autor ja gerados, para as duplicatas
+
+    for i in range(n):
+        if recentes and rng.random() < duplicatas:
+            titulo, autor = rng.choice(recentes)
+            titulo = rng.choice((titulo.upper(), titulo.lower(), " " + titulo))
+        else:
+            palavras = rng.sample(PALAVRAS, rng.randint(1, 4))
+            titulo = " ".join(palavras).capitalize()
+            if rng.random() < 0.3:
+                titulo = rng.choice(("O ", "A ", "Os ", "As ")) + titulo
+            titulo += " " + str(i) if rng.random() < 0.5 else ""
+            autor = rng.choices(autores, cum_weights=acum_autor)[0]
+            if len(recentes) < 50_000:
+                recentes.append((titulo, autor))
+            else:
+                recentes[rng.randrange(len(recentes))] = (titulo, autor)
+
+        genero  = rng.choices(GENEROS, cum_weights=acum_genero)[0]
+        ano     = rng.randint(1850, 2025) if rng.random() < 0.85 else None
+        editora = rng.choice(EDITORAS)
+        lido    = 1 if rng.random() < 0.4 else 0
+        nota    = round(rng.uniform(0, 10), 1) if lido and rng.random() < 0.7 else None
+        obs     = (" ".join(rng.choices(PALAVRAS, k=rng.randint(5, 60)))
+                   if rng.random() < 0.2 else None)
+        yield titulo, autor, genero, ano, editora, lido, nota, obs
+
+
+def gerar_banco(path, n, duplicatas=0.0, seed=0):
+    """Cria `path` com `n` livros sinteticos (as primeiras `n` linhas de
+    livros_sinteticos)."""
+    if os.path.exists(path):
+        os.remove(path)
+    repo = RepositorioLivros(path)
+    repo.iniciar()
+    con = repo.conexao()
+    for lote in em_lotes(livros_sinteticos(n, duplicatas, seed), TAMANHO_LOTE * 10):
+        with repo.transacao():
+            con.executemany(INSERT_LIVRO,
+                            [r + (chave_livro(r[0], r[1]),) for r in lote])
+    con.execute("ANALYZE")
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return repo
+
+
+CABECALHO_CSV = ["Title", "Author", "Genre", "Year", "Publisher", "Read",
+                 "Rating", "Notes"]
+MAPA_CSV = dict(zip(dados.CAMPOS_IMPORTACAO, CABECALHO_CSV))
+
+
+def gerar_csv(path, n, duplicatas=0.0, seed=0, pular=0):
+    """Grava um CSV com os `n` livros que vem depois dos `pular` primeiros de
+    livros_sinteticos, entao as duplicatas tambem acertam livros do banco
+    gerado com o mesmo `seed`."""
+    rng = random.Random(seed + 1)
+    livros = livros_sinteticos(pular + n, duplicatas, seed)
+    for _ in range(pular):
+        next(livros)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(CABECALHO_CSV)
+        for titulo, autor, genero, ano, editora, lido, nota, obs in livros:
+            w.writerow([titulo, autor, rng.choice(GENEROS_CSV[genero]),
+                        ano or "", editora or "", "Sim" if lido else "",
+                        str(nota).replace(".", ",") if nota is not None else "",
+                        obs or ""])
+
+
+def copiar_banco(origem, destino):
+    """Copia um banco pela API de backup (pega o que esta no WAL tambem)."""
+    if os.path.exists(destino):
+        os.remove(destino)
+    src = sqlite3.connect(origem)
+    dst = sqlite3.connect(destino)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+# ── Medicao ───────────────────────────────────────────────────────────────────
+
+def medir(funcao, repeticoes=3, preparar=None):
+    """Roda `funcao()` `repeticoes` vezes (com `preparar()` antes de cada uma,
+    fora do tempo) e devolve os tempos e o ultimo resultado."""
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return {"segundos": statistics.median(tempos), "min": min(tempos),
+            "max": max(tempos), "repeticoes": repeticoes}, resultado
+
+
+# Combinacoes da lista como o App as monta em _consulta_atual()
+CONSULTAS = {
+    "titulo":              dict(),
+    "autor_desc":          dict(sort_col="autor", sort_rev=True),
+    "genero_por_ano":      dict(genero="Fantasia", sort_col="ano"),
+    "lidos_por_nota":      dict(lido=True, sort_col="nota", sort_rev=True),
+    "genero_lidos_editora": dict(genero="Romance", lido=False, sort_col="editora"),
+    "busca":               dict(busca="amor"),
+    "busca_genero_titulo": dict(busca="noite mar", genero="Romance",
+                                sort_col="titulo"),
+}
+
+
+def medir_consultas(repo, repeticoes):
+    """Primeira pagina + totais (carregar_livros), sem e com o cache, e a
+    rolagem por mais dez paginas (_carregar_mais) de cada combinacao de
+    CONSULTAS."""
+    res = {}
+    for nome, kw in CONSULTAS.items():
+        kw = dict(kw)
+        consulta = Consulta(kw.pop("busca", ""), **kw)
+
+        def primeira():
+            return repo.primeira_pagina(consulta)
+
+        def rolar():
+            rows = []
+            for _ in range(11):
+                pagina = repo.pagina(consulta, rows[-1] if rows else None, len(rows))
+                rows += pagina
+                if len(pagina) < TAMANHO_PAGINA:
+                    break
+            return rows
+
+        tempo, (rows, totais) = medir(primeira, repeticoes, repo.cache.limpar)
+        res["consulta:" + nome] = dict(tempo, linhas=len(rows), total=totais[0])
+        tempo, _ = medir(primeira, repeticoes)
+        res["cache:" + nome] = tempo
+        tempo, rows = medir(rolar, repeticoes)
+        res["rolagem:" + nome] = dict(tempo, linhas=len(rows))
+    return res
+
+
+def medir_escrita(repo, repeticoes, operacoes=200):
+    """Salvar (inserir e editar, como JanelaCadastro) e remover um livro,
+    uma transacao por operacao; o tempo informado e por operacao."""
+    amostra = list(livros_sinteticos(operacoes, seed=99))
+    ids = []
+
+    def inserir():
+        ids[:] = [repo.inserir(*r) for r in amostra]
+
+    def editar():
+        for lid, r in zip(ids, amostra):
+            repo.atualizar(lid, r[0] + " (2a ed.)", *r[1:])
+
+    def remover():
+        for lid in ids:
+            repo.remover(lid)
+        ids.clear()
+
+    res = {}
+    for nome, funcao, preparar in (("salvar_novo",   inserir, remover),
+                                   ("salvar_edicao", editar,  None),
+                                   ("remover",       remover, lambda: ids or inserir())):
+        tempo, _ = medir(funcao, repeticoes, preparar)
+        for k in ("segundos", "min", "max"):
+            tempo[k] /= operacoes
+        res[nome] = dict(tempo, operacoes=operacoes)
+    return res
+
+
+def medir_csv(base, pasta, n, duplicatas, seed, repeticoes):
+    """Importacao (com e sem deduplicacao) de um CSV com n/10 livros numa
+    copia do banco, e exportacao da biblioteca inteira."""
+    m = max(n // 10, 1000)
+    path_csv = os.path.join(pasta, "importar_{}_{}_{}.csv".format(n, duplicatas, seed))
+    if not os.path.exists(path_csv):
+        gerar_csv(path_csv, m, duplicatas, seed, pular=n)
+    copia = os.path.join(pasta, "copia.db")
+    res = {}
+
+    for nome, dedup in (("importar", False), ("importar_dedup", True)):
+        def preparar():
+            fechar_conexao()
+            copiar_banco(base, copia)
+
+        tempo, r = medir(lambda: RepositorioLivros(copia).importar(
+            path_csv, None, MAPA_CSV, dedup, paralelo=False), repeticoes, preparar)
+        res[nome] = dict(tempo, linhas=m, inseridos=r["inseridos"],
+                         ignorados=r["ignorados"])
+
+    fechar_conexao()
+    os.remove(copia)
+    saida = os.path.join(pasta, "exportado.csv")
+    tempo, feitos = medir(lambda: RepositorioLivros(base).exportar(saida), repeticoes)
+    res["exportar"] = dict(tempo, linhas=feitos, bytes=os.path.getsize(saida))
+    os.remove(saida)
+    return res
+
+# ── Treeview ──────────────────────────────────────────────────────────────────
+
+class TreeviewFalso:
+    """Substitui o ttk.Treeview sem tela: so guarda os itens."""
+
+    def __init__(self):
+        self.itens = {}
+
+    def insert(self, parent, index, iid=None, values=(), tags=()):
+        self.itens[iid] = (values, tags)
+        return iid
+
+    def delete(self, *iids):
+        for iid in iids:
+            del self.itens[iid]
+
+    def get_children(self, item=""):
+        return tuple(self.itens)
+
+
+def _treeview():
+    """Um ttk.Treeview real se houver tela, senao (None, TreeviewFalso)."""
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        raiz = tk.Tk()
+    except Exception:
+        return None, TreeviewFalso()
+    raiz.withdraw()
+    cols = ("titulo", "autor", "genero", "ano", "editora", "lido", "nota")
+    return raiz, ttk.Treeview(raiz, columns=cols, show="headings")
+
+
+def medir_treeview(repo, repeticoes, paginas=10):
+    """Preenche a lista como _exibir_livros e _carregar_mais: limpa a arvore
+    e insere `paginas` paginas ja buscadas (o tempo nao inclui o SQL)."""
+    try:
+        from biblioteca_3 import App
+    except ImportError:  # sem tkinter
+        return {}
+
+    consulta = Consulta()
+    rows = []
+    for _ in range(paginas):
+        rows += repo.pagina(consulta, rows[-1] if rows else None, len(rows))
+
+    raiz, tree = _treeview()
+    lista = type("Lista", (), {"_valores": staticmethod(App._valores),
+                               "_tags": staticmethod(App._tags)})()
+    lista.tree = tree
+    lista._selecao_total = False
+
+    def popular():
+        lista._livros = ListaLivros()
+        tree.delete(*tree.get_children())
+        for i in range(0, len(rows), TAMANHO_PAGINA):
+            App._inserir_linhas(lista, rows[i:i + TAMANHO_PAGINA])
+        if raiz is not None:
+            raiz.update_idletasks()
+
+    try:
+        tempo, _ = medir(popular, repeticoes)
+    finally:
+        if raiz is not None:
+            raiz.destroy()
+    return {"treeview": dict(tempo, linhas=len(rows), falso=raiz is None)}
+
+# ── Memoria ───────────────────────────────────────────────────────────────────
+
+def _memoria(funcao):
+    """Bytes alocados (tracemalloc) pelo resultado de `funcao()`."""
+    tracemalloc.start()
+    try:
+        resultado = funcao()
+        usados = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del resultado
+    return usados
+
+
+def medir_memoria(repo, limite=100_000):
+    """Memoria para guardar ate `limite` linhas da lista: tuplas completas
+    (SELECT *) contra a ListaLivros com so as colunas mostradas. As linhas
+    da ListaLivros sao lidas antes de medir, para nao contar o que a
+    consulta deixa na conexao (statements em cache, p.ex.)."""
+    consulta = Consulta()
+    completas = _memoria(lambda: list(islice(repo.consultar(consulta), limite)))
+    rows = repo.pagina(consulta, limite=limite)
+    lista = _memoria(lambda: ListaLivros(rows))
+    return {"memoria_lista": {"bytes_tuplas_completas": completas,
+                              "bytes_lista_livros": lista,
+                              "linhas": min(limite, repo.totais(consulta)[0])}}
+
+# ── Execucao ──────────────────────────────────────────────────────────────────
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def rodar(tamanhos, pasta, duplicatas=0.05, seed=0, repeticoes=3,
+          casos=CASOS, log=print):
+    """Roda os casos em cada tamanho e devolve o dict gravado no JSON."""
+    resultado = {
+        "commit": _commit(),
+        "data": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "plataforma": platform.platform(),
+        "parametros": {"duplicatas": duplicatas, "seed": seed,
+                       "repeticoes": repeticoes},
+        "tamanhos": {},
+    }
+    for n in tamanhos:
+        base = os.path.join(pasta, "biblioteca_{}_{}_{}.db".format(n, duplicatas, seed))
+        res = {}
+        if not os.path.exists(base):
+            log("gerando {} livros...".format(n))
+            inicio = time.perf_counter()
+            gerar_banco(base, n, duplicatas, seed)
+            res["gerar_banco"] = {"segundos": time.perf_counter() - inicio}
+            fechar_conexao()
+
+        # Casos que escrevem usam uma copia, para a base continuar igual
+        trabalho = os.path.join(pasta, "trabalho.db")
+        copiar_banco(base, trabalho)
+        repo = RepositorioLivros(trabalho)
+        repo.iniciar()
+        if "consultas" in casos:
+            log("{}: consultas".format(n))
+            res.update(medir_consultas(repo, repeticoes))
+        if "treeview" in casos:
+            log("{}: treeview".format(n))
+            res.update(medir_treeview(repo, repeticoes))
+        if "memoria" in casos:
+            log("{}: memoria".format(n))
+            res.update(medir_memoria(repo))
+        if "escrita" in casos:
+            log("{}: salvar/remover".format(n))
+            res.update(medir_escrita(repo, repeticoes))
+        fechar_conexao()
+        os.remove(trabalho)
+        if "csv" in casos:
+            log("{}: importar/exportar".format(n))
+            res.update(medir_csv(base, pasta, n, duplicatas, seed, repeticoes))
+        resultado["tamanhos"][str(n)] = res
+    return resultado
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--tamanhos", type=int, nargs="+", default=list(TAMANHOS[:2]),
+                   help="livros por banco (padrao: 10000 100000; o conjunto "
+                        "completo e {})".format(" ".join(map(str, TAMANHOS))))
+    p.add_argument("--duplicatas", type=float, default=0.05,
+                   help="fracao de livros repetidos (padrao 0.05)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeticoes", type=int, default=3)
+    p.add_argument("--casos", nargs="+", default=list(CASOS), choices=CASOS)
+    p.add_argument("--dir", default=os.path.join(tempfile.gettempdir(),
+                                                 "biblioteca_bench"),
+                   help="onde guardar os bancos e CSVs gerados")
+    p.add_argument("--saida", default="benchmark.json")
+    args = p.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    resultado = rodar(args.tamanhos, args.dir, args.duplicatas, args.seed,
+                      args.repeticoes, args.casos,
+                      log=lambda msg: print(msg, file=sys.stderr))
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print("resultados em {}".format(args.saida), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
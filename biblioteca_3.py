@@ -1,35 +1,31 @@
+import time
+INICIO = time.perf_counter()   # para o relatorio de inicializacao
+
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import sqlite3
-import csv
+import logging
+import queue
+import threading
+import os
 from datetime import datetime
 
-# ── Banco de Dados ────────────────────────────────────────────────────────────
-
-DB_FILE = "biblioteca.db"
-
-def init_db():
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS livros (
-            id        INTEGER PRIMARY KEY AUTOINCREMENT,
-            titulo    TEXT NOT NULL,
-            autor     TEXT NOT NULL,
-            genero    TEXT NOT NULL,
-            ano       INTEGER,
-            editora   TEXT,
-            lido      INTEGER DEFAULT 0,
-            nota      REAL,
-            obs       TEXT,
-            criado_em TEXT DEFAULT (datetime('now','localtime'))
-        )
-    """)
-    con.commit()
-    con.close()
+from biblioteca_dados import (
+    TAMANHO_PAGINA, DIAGNOSTICO_PLANOS, GENEROS, MEDICAO, Consulta,
+    ListaLivros, RepositorioLivros, amostra_csv, ativar_log_lentas,
+    detectar_coluna, fechar_conexao, reconstruir_indice_busca, valor_csv,
+)
+
+ATRASO_BUSCA_MS = 250   # debounce do campo Buscar
+LIMITE_ATUALIZACAO_LOCAL = 500  # acima disso a lista e recarregada inteira
+AMOSTRA_CSV     = 5     # linhas do CSV mantidas para a previa
+PRIMEIRA_TELA   = 40    # linhas da primeira pintura; o resto da pagina vem depois
+ATRASO_COPIA_MS = 60 * 1000        # primeira verificacao da copia agendada
+VERIFICAR_COPIA_MS = 3600 * 1000   # e depois a cada hora
 
-def get_connection():
-    return sqlite3.connect(DB_FILE)
+# BIBLIOTECA_INICIO=1 mostra no terminal o relatorio de inicializacao
+log_inicio = logging.getLogger("biblioteca.inicio")
+log_copias = logging.getLogger("biblioteca.copias")
 
 # ── Paleta de cores ───────────────────────────────────────────────────────────
 
@@ -44,23 +40,9 @@ DANGER     = "#ef4444"
 ROW_ODD    = "#252535"
 ROW_EVEN   = "#2e2e42"
 
-GENEROS = [
-    "Ficção Científica", "Fantasia", "Romance", "Terror/Horror",
-    "Mistério/Policial", "Aventura", "Biografia", "História",
-    "Filosofia", "Ciência", "Tecnologia", "Autoajuda",
-    "Negócios", "Arte", "Poesia", "Infantil", "Infanto-juvenil", "Outros"
-]
 
 # ── Janela de Cadastro/Edicao ─────────────────────────────────────────────────
 
-def _mapear_genero(valor):
-    if not valor:
-        return "Outros"
-    for g in GENEROS:
-        if g.lower() in valor.lower() or valor.lower() in g.lower():
-            return g
-    return "Outros"
-
 
 class JanelaCadastro(tk.Toplevel):
     def __init__(self, parent, livro=None):
@@ -189,35 +171,176 @@ class JanelaCadastro(tk.Toplevel):
                                    "Ano deve ser numero inteiro e Nota entre 0 e 10.", parent=self)
             return
 
-        con = get_connection()
-        cur = con.cursor()
-        if self.livro:
-            cur.execute("""UPDATE livros SET titulo=?,autor=?,genero=?,ano=?,editora=?,
-                           lido=?,nota=?,obs=? WHERE id=?""",
-                        (titulo, autor, genero, ano, editora, lido, nota, obs, self.livro[0]))
+        repo = self.parent.repo
+        try:
+            if self.livro:
+                lid = self.livro[0]
+                repo.atualizar(lid, titulo, autor, genero, ano, editora, lido,
+                               nota, obs)
+            else:
+                lid = repo.inserir(titulo, autor, genero, ano, editora, lido,
+                                   nota, obs)
+        except sqlite3.IntegrityError:
+            messagebox.showwarning("Livro duplicado",
+                                   "Ja existe um livro com este titulo e autor.",
+                                   parent=self)
+            return
+        self.parent.livros_alterados([lid])
+        self.destroy()
+
+# ── Janela de Escolha ─────────────────────────────────────────────────────────
+
+class JanelaEscolha(tk.Toplevel):
+    """Pede um valor: o genero das alteracoes em massa, a politica da mescla,
+    ou uma nota.
+
+    Com `opcoes` mostra um combo; sem, um campo de nota (vazio tira a nota).
+    ao_confirmar(valor) recebe o valor ja validado.
+    """
+
+    def __init__(self, parent, titulo, rotulo, ao_confirmar, opcoes=None):
+        super().__init__(parent)
+        self.parent       = parent
+        self.ao_confirmar = ao_confirmar
+        self.opcoes       = opcoes
+        self.title(titulo)
+        self.configure(bg=BG)
+        self.resizable(False, False)
+        self.grab_set()
+        self._build(rotulo)
+        self.update_idletasks()
+        self._centralizar()
+
+    def _centralizar(self):
+        w, h = self.winfo_width(), self.winfo_height()
+        x = self.parent.winfo_x() + (self.parent.winfo_width()  - w) // 2
+        y = self.parent.winfo_y() + (self.parent.winfo_height() - h) // 2
+        self.geometry("+{}+{}".format(x, y))
+
+    def _build(self, rotulo):
+        frame = tk.Frame(self, bg=BG, padx=24, pady=20)
+        frame.pack(fill="both", expand=True)
+
+        tk.Label(frame, text=rotulo, bg=BG, fg=TEXT_MUTED,
+                 font=("Segoe UI", 9)).grid(row=0, column=0, sticky="w", pady=(8,2))
+
+        if self.opcoes:
+            self.campo = ttk.Combobox(frame, values=self.opcoes, state="readonly",
+                                      font=("Segoe UI", 10), width=28)
+            self.campo.set(self.opcoes[0])
         else:
-            cur.execute("""INSERT INTO livros (titulo,autor,genero,ano,editora,lido,nota,obs)
-                           VALUES (?,?,?,?,?,?,?,?)""",
-                        (titulo, autor, genero, ano, editora, lido, nota, obs))
-        con.commit()
-        con.close()
-        self.parent.carregar_livros()
+            self.campo = tk.Entry(frame, bg=SURFACE, fg=TEXT, insertbackground=TEXT,
+                                  relief="flat", font=("Segoe UI", 10), width=30,
+                                  highlightthickness=1, highlightbackground=ACCENT,
+                                  highlightcolor=ACCENT)
+            self.campo.bind("<Return>", lambda _: self._confirmar())
+        self.campo.grid(row=0, column=1, sticky="ew", padx=(8,0), pady=(8,2))
+        self.campo.focus_set()
+
+        btn_frame = tk.Frame(frame, bg=BG)
+        btn_frame.grid(row=1, column=0, columnspan=2, pady=(18,0))
+
+        tk.Button(btn_frame, text="Cancelar", command=self.destroy,
+                  bg=SURFACE, fg=TEXT_MUTED, relief="flat",
+                  font=("Segoe UI", 10), padx=18, pady=8,
+                  cursor="hand2").pack(side="left", padx=(0,10))
+
+        tk.Button(btn_frame, text="  Aplicar  ", command=self._confirmar,
+                  bg=ACCENT, fg="white", relief="flat",
+                  font=("Segoe UI", 10, "bold"), padx=18, pady=8,
+                  cursor="hand2", activebackground=ACCENT2,
+                  activeforeground="white").pack(side="left")
+
+    def _confirmar(self):
+        valor = self.campo.get().strip()
+        if not self.opcoes:
+            try:
+                valor = float(valor) if valor else None
+                if valor is not None and not (0 <= valor <= 10):
+                    raise ValueError
+            except ValueError:
+                messagebox.showwarning("Valor invalido",
+                                       "Nota deve ser um numero entre 0 e 10.",
+                                       parent=self)
+                return
         self.destroy()
+        self.ao_confirmar(valor)
+
+# ── Janela de Progresso ───────────────────────────────────────────────────────
+
+class JanelaProgresso(tk.Toplevel):
+    """Janela com barra de progresso para uma TarefaSegundoPlano."""
+
+    def __init__(self, parent, titulo):
+        super().__init__(parent)
+        self.parent = parent
+        self.tarefa = None
+        self.title(titulo)
+        self.configure(bg=BG)
+        self.resizable(False, False)
+        self.transient(parent)
+        self.protocol("WM_DELETE_WINDOW", self._cancelar)
+        self._build(titulo)
+        self.update_idletasks()
+        self._centralizar()
+
+    def _centralizar(self):
+        w, h = self.winfo_width(), self.winfo_height()
+        x = self.parent.winfo_x() + (self.parent.winfo_width()  - w) // 2
+        y = self.parent.winfo_y() + (self.parent.winfo_height() - h) // 2
+        self.geometry("+{}+{}".format(x, y))
+
+    def _build(self, titulo):
+        frame = tk.Frame(self, bg=BG, padx=24, pady=20)
+        frame.pack(fill="both", expand=True)
+
+        tk.Label(frame, text=titulo, bg=BG, fg=TEXT,
+                 font=("Segoe UI", 13, "bold")).pack(anchor="w", pady=(0,8))
+
+        self.barra = ttk.Progressbar(frame, mode="determinate", length=360)
+        self.barra.pack(fill="x")
+
+        self.lbl = tk.Label(frame, text="Iniciando...", bg=BG, fg=TEXT_MUTED,
+                            font=("Segoe UI", 9))
+        self.lbl.pack(anchor="w", pady=(6,0))
+
+        tk.Button(frame, text="Cancelar", command=self._cancelar,
+                  bg=SURFACE, fg=TEXT_MUTED, relief="flat",
+                  font=("Segoe UI", 10), padx=18, pady=8,
+                  cursor="hand2").pack(pady=(14,0))
+
+    def atualizar(self, feitos, total, texto):
+        if not self.winfo_exists():
+            return
+        self.barra.config(maximum=max(total, 1), value=feitos)
+        self.lbl.config(text=texto)
+
+    def _cancelar(self):
+        if self.tarefa is not None:
+            self.tarefa.cancelar()
+            self.lbl.config(text="Cancelando...")
+        else:
+            self.destroy()
 
 # ── Janela de Importacao CSV ──────────────────────────────────────────────────
 
 class JanelaCSV(tk.Toplevel):
     """Janela de importacao de CSV com mapeamento de colunas."""
 
-    def __init__(self, parent, rows, colunas):
+    def __init__(self, parent, path, formato, colunas, amostra):
         super().__init__(parent)
-        self.parent  = parent
-        self.rows    = rows
-        self.colunas = ["(ignorar)"] + list(colunas)
+        self.parent   = parent
+        self.path     = path
+        self.formato  = formato
+        self.amostra  = amostra
+        self.colunas  = ["(ignorar)"] + list(colunas)
+        self.tamanho  = os.path.getsize(path)
+        self.tarefa   = None
         self.title("Importar CSV")
         self.configure(bg=BG)
         self.resizable(False, False)
         self.grab_set()
+        self.protocol("WM_DELETE_WINDOW", self._fechar)
         self._build()
         self.update_idletasks()
         self._centralizar()
@@ -237,25 +360,24 @@ class JanelaCSV(tk.Toplevel):
         cb = ttk.Combobox(frame, textvariable=var, values=self.colunas,
                           state="readonly", font=("Segoe UI", 10), width=30)
         cb.grid(row=row, column=1, sticky="ew", padx=(10,0), pady=(8,2))
+
+        # Previa: valor da primeira linha do CSV na coluna escolhida
+        previa = tk.Label(frame, bg=BG, fg=TEXT_MUTED, font=("Segoe UI", 9),
+                          width=24, anchor="w")
+        previa.grid(row=row, column=2, sticky="w", padx=(10,0), pady=(8,2))
+
+        def atualizar(*_):
+            col = var.get()
+            val = valor_csv(self.amostra[0], col) if col != "(ignorar)" else None
+            val = val or ""
+            previa.config(text=val if len(val) <= 30 else val[:29] + "...")
+        var.trace_add("write", atualizar)
+        atualizar()
         return var
 
     def _auto_detectar(self, campo):
         """Tenta achar automaticamente a coluna do CSV para cada campo."""
-        sinonimos = {
-            "titulo": ["titulo", "title", "nome", "name", "livro", "book"],
-            "autor":  ["autor", "author", "escritor", "writer"],
-            "genero": ["genero", "genre", "categoria", "category", "tipo"],
-            "ano":    ["ano", "year", "ano_publicacao", "published"],
-            "editora":["editora", "publisher", "editora/publisher"],
-            "lido":   ["lido", "read", "lido?", "ja lido", "concluido"],
-            "nota":   ["nota", "rating", "avaliacao", "score", "pontuacao"],
-            "obs":    ["obs", "observacoes", "notes", "notas", "comentarios"],
-        }
-        for col in self.colunas[1:]:  # skip (ignorar)
-            for syn in sinonimos.get(campo, []):
-                if syn in col.lower().replace(" ", "_"):
-                    return col
-        return "(ignorar)"
+        return detectar_coluna(campo, self.colunas[1:]) or "(ignorar)"
 
     def _build(self):
         frame = tk.Frame(self, bg=BG, padx=24, pady=20)
@@ -265,11 +387,13 @@ class JanelaCSV(tk.Toplevel):
                  font=("Segoe UI", 13, "bold")).grid(
                  row=0, column=0, columnspan=2, sticky="w", pady=(0,4))
 
-        info = "Arquivo com {} linha(s). Mapeie as colunas do CSV para cada campo:".format(
-            len(self.rows))
+        info = ("{} ({:.1f} MB, {}, separador {!r}). "
+                "Mapeie as colunas do CSV para cada campo:").format(
+            os.path.basename(self.path), self.tamanho / 1e6,
+            self.formato.encoding, self.formato.delimitador)
         tk.Label(frame, text=info, bg=BG, fg=TEXT_MUTED,
                  font=("Segoe UI", 9)).grid(
-                 row=1, column=0, columnspan=2, sticky="w", pady=(0,12))
+                 row=1, column=0, columnspan=3, sticky="w", pady=(0,12))
 
         campos = [
             ("Titulo *",    "titulo"),
@@ -295,21 +419,28 @@ class JanelaCSV(tk.Toplevel):
                        variable=self.skip_dup, bg=BG, fg=TEXT,
                        selectcolor=SURFACE, activebackground=BG,
                        font=("Segoe UI", 10)).grid(
-                       row=2+len(campos), column=0, columnspan=2,
+                       row=2+len(campos), column=0, columnspan=3,
                        sticky="w", pady=(14,0))
 
+        self.progresso = ttk.Progressbar(frame, mode="determinate",
+                                         maximum=max(self.tamanho, 1))
+        self.progresso.grid(row=3+len(campos), column=0, columnspan=3,
+                            sticky="ew", pady=(10,0))
+
         self.lbl_status = tk.Label(frame, text="", bg=BG, fg=TEXT_MUTED,
                                    font=("Segoe UI", 9))
-        self.lbl_status.grid(row=3+len(campos), column=0, columnspan=2,
+        self.lbl_status.grid(row=4+len(campos), column=0, columnspan=3,
                              sticky="w", pady=(6,0))
 
         btn_frame = tk.Frame(frame, bg=BG)
-        btn_frame.grid(row=4+len(campos), column=0, columnspan=2, pady=(14,0))
+        btn_frame.grid(row=5+len(campos), column=0, columnspan=3, pady=(14,0))
 
-        tk.Button(btn_frame, text="Cancelar", command=self.destroy,
+        self.btn_cancelar = tk.Button(btn_frame, text="Cancelar",
+                  command=self._fechar,
                   bg=SURFACE, fg=TEXT_MUTED, relief="flat",
                   font=("Segoe UI", 10), padx=18, pady=8,
-                  cursor="hand2").pack(side="left", padx=(0,10))
+                  cursor="hand2")
+        self.btn_cancelar.pack(side="left", padx=(0,10))
 
         self.btn_imp = tk.Button(btn_frame, text="  Importar  ",
                   command=self._importar,
@@ -319,106 +450,305 @@ class JanelaCSV(tk.Toplevel):
                   activeforeground="white")
         self.btn_imp.pack(side="left")
 
-    def _get_val(self, row, campo):
-        col = self.map_vars[campo].get()
-        if col == "(ignorar)":
-            return None
-        return row.get(col, "").strip() or None
+    def _fechar(self):
+        """Cancelar: interrompe a importacao em andamento ou fecha a janela."""
+        if self.tarefa is not None:
+            self.tarefa.cancelar()
+            self.lbl_status.config(text="Interrompendo...", fg=TEXT_MUTED)
+        else:
+            self.destroy()
 
     def _importar(self):
-        titulo_col = self.map_vars["titulo"].get()
-        autor_col  = self.map_vars["autor"].get()
+        mapa = {}
+        for campo, var in self.map_vars.items():
+            col = var.get()
+            mapa[campo] = col if col != "(ignorar)" else None
 
-        if titulo_col == "(ignorar)" or autor_col == "(ignorar)":
+        if not mapa["titulo"] or not mapa["autor"]:
             messagebox.showwarning("Campos obrigatorios",
                                    "Mapeie pelo menos Titulo e Autor.", parent=self)
             return
 
         self.btn_imp.config(state="disabled", text="Importando...")
+        self.btn_cancelar.config(text="Parar")
         self.lbl_status.config(text="Processando...", fg=TEXT_MUTED)
-        self.update()
-
-        con = get_connection()
-        inseridos = 0
-        ignorados = 0
-        erros     = 0
-
-        for row in self.rows:
-            titulo = (row.get(titulo_col) or "").strip()
-            autor  = (row.get(autor_col)  or "").strip()
-            if not titulo or not autor:
-                erros += 1
-                continue
+        self.progresso.config(value=0)
+        self._inicio = time.perf_counter()
+
+        skip_dup = self.skip_dup.get()
+        self.tarefa = TarefaSegundoPlano(
+            self.parent,
+            lambda progresso, cancelado: self.parent.repo.importar(
+                self.path, self.formato, mapa, skip_dup, progresso, cancelado),
+            ao_progresso=self._ao_progresso,
+            ao_concluir=self._ao_concluir,
+            ao_falhar=self._ao_falhar)
+
+    def _ao_progresso(self, lidos, linhas):
+        if not self.winfo_exists():
+            return
+        decorrido = max(time.perf_counter() - self._inicio, 1e-6)
+        self.progresso.config(value=lidos)
+        self.lbl_status.config(
+            text="{} linha(s) processada(s)  |  {:.0f} linhas/s".format(
+                linhas, linhas / decorrido), fg=TEXT_MUTED)
+
+    def _ao_falhar(self, erro):
+        self.tarefa = None
+        if self.winfo_exists():
+            self.btn_imp.config(state="normal", text="  Importar  ")
+            self.btn_cancelar.config(text="Cancelar")
+            self.lbl_status.config(text="Erro: {}".format(erro), fg=DANGER)
+        self.parent.carregar_livros()
 
-            if self.skip_dup.get():
-                existe = con.execute(
-                    "SELECT 1 FROM livros WHERE LOWER(titulo)=LOWER(?) AND LOWER(autor)=LOWER(?)",
-                    (titulo, autor)
-                ).fetchone()
-                if existe:
-                    ignorados += 1
-                    continue
+    def _ao_concluir(self, res):
+        self.tarefa = None
 
-            genero_raw = self._get_val(row, "genero")
-            genero = _mapear_genero(genero_raw) if genero_raw else "Outros"
+        novos = self.parent.repo.ids_apos(res["ultimo_id"],
+                                          LIMITE_ATUALIZACAO_LOCAL + 1)
+        if len(novos) <= LIMITE_ATUALIZACAO_LOCAL:
+            self.parent.livros_alterados(novos)
+        else:
+            self.parent.carregar_livros()
 
-            ano_raw = self._get_val(row, "ano")
-            try:
-                ano = int(ano_raw) if ano_raw else None
-            except ValueError:
-                ano = None
+        if not self.winfo_exists():
+            return
 
-            editora = self._get_val(row, "editora")
+        msg = "{} livro(s) importado(s)!".format(res["inseridos"])
+        if res["cancelado"]:
+            msg = "Importacao interrompida: " + msg
+        if res["ignorados"]:
+            msg += "  ({} duplicado(s) ignorado(s))".format(res["ignorados"])
+        if res["erros"]:
+            msg += "  ({} linha(s) sem titulo/autor ignorada(s))".format(res["erros"])
 
-            lido_raw = self._get_val(row, "lido")
-            if lido_raw:
-                lido = 1 if lido_raw.lower() in ("sim", "yes", "true", "1", "x", "v") else 0
-            else:
-                lido = 0
+        if not res["cancelado"]:
+            self.progresso.config(value=self.tamanho)
+        self.lbl_status.config(text=msg, fg=SUCCESS)
+        self.btn_imp.config(state="normal", text="  Importar  ")
+        self.btn_cancelar.config(text="Cancelar")
 
-            nota_raw = self._get_val(row, "nota")
-            try:
-                nota = float(nota_raw.replace(",", ".")) if nota_raw else None
-                if nota is not None and not (0 <= nota <= 10):
-                    nota = None
-            except (ValueError, AttributeError):
-                nota = None
 
-            obs = self._get_val(row, "obs")
+# ── Segundo plano ─────────────────────────────────────────────────────────────
 
-            con.execute(
-                "INSERT INTO livros (titulo,autor,genero,ano,editora,lido,nota,obs) VALUES (?,?,?,?,?,?,?,?)",
-                (titulo, autor, genero, ano, editora, lido, nota, obs)
-            )
-            inseridos += 1
+class TarefaSegundoPlano:
+    """Roda `funcao(progresso, cancelado)` numa thread fora do Tk.
 
-        con.commit()
-        con.close()
+    A funcao chama `progresso(...)` quando quiser; o Tk recebe so o valor mais
+    recente a cada verificacao. `cancelado` e um threading.Event que a funcao
+    deve consultar. No fim, ao_concluir(resultado) ou ao_falhar(erro) rodam
+    na thread do Tk.
+    """
 
-        msg = "{} livro(s) importado(s)!".format(inseridos)
-        if ignorados:
-            msg += "  ({} duplicado(s) ignorado(s))".format(ignorados)
-        if erros:
-            msg += "  ({} linha(s) sem titulo/autor ignorada(s))".format(erros)
+    INTERVALO_VERIFICACAO_MS = 100
 
-        self.lbl_status.config(text=msg, fg=SUCCESS)
-        self.btn_imp.config(state="normal", text="  Importar  ")
-        self.parent.carregar_livros()
+    def __init__(self, widget, funcao, ao_progresso=None,
+                 ao_concluir=None, ao_falhar=None):
+        self.widget       = widget
+        self.funcao       = funcao
+        self.ao_progresso = ao_progresso
+        self.ao_concluir  = ao_concluir
+        self.ao_falhar    = ao_falhar
+        self.cancelado    = threading.Event()
+
+        self._progresso = None
+        self._fim       = None
+
+        threading.Thread(target=self._rodar, daemon=True).start()
+        self.widget.after(self.INTERVALO_VERIFICACAO_MS, self._verificar)
+
+    def cancelar(self):
+        self.cancelado.set()
+
+    def _rodar(self):
+        try:
+            resultado = self.funcao(self._registrar_progresso, self.cancelado)
+        except Exception as e:
+            self._fim = (False, e)
+        else:
+            self._fim = (True, resultado)
+        finally:
+            fechar_conexao()
+
+    def _registrar_progresso(self, *args):
+        self._progresso = args
+
+    def _verificar(self):
+        progresso, self._progresso = self._progresso, None
+        if progresso is not None and self.ao_progresso:
+            self.ao_progresso(*progresso)
+
+        if self._fim is None:
+            self.widget.after(self.INTERVALO_VERIFICACAO_MS, self._verificar)
+            return
+
+        ok, valor = self._fim
+        if ok and self.ao_concluir:
+            self.ao_concluir(valor)
+        elif not ok and self.ao_falhar:
+            self.ao_falhar(valor)
+
+class AgendadorBusca:
+    """Executa as consultas da lista numa thread com conexao propria.
+
+    Uma tarefa e uma funcao que recebe o repositorio e devolve o resultado a
+    ser passado para `aplicar`; chamado nesta thread, ele usa a conexao dela.
+
+    agendar() espera `atraso_ms` sem novas chamadas antes de disparar a
+    consulta (debounce). Cada disparo recebe uma geracao; resultados de
+    geracoes superadas sao descartados e a consulta em andamento e
+    interrompida. O resultado volta para a thread do Tk via after().
+    """
+
+    INTERVALO_VERIFICACAO_MS = 30
+
+    def __init__(self, widget, repo, aplicar, ao_erro=None,
+                 atraso_ms=ATRASO_BUSCA_MS):
+        self.widget    = widget
+        self.repo      = repo
+        self.aplicar   = aplicar
+        self.ao_erro   = ao_erro
+        self.atraso_ms = atraso_ms
+
+        self._geracao     = 0
+        self._disparada   = None   # ultima geracao enviada ao worker
+        self._recebida    = None   # ultima geracao aplicada na tela
+        self._executando  = None   # geracao que o worker esta rodando
+        self._pendente    = None   # id do after() do debounce
+        self._verificando = False
+        self._pedidos     = queue.Queue()
+        self._resultados  = queue.Queue()
+        self._con         = None
+
+        threading.Thread(target=self._trabalhar, name="busca",
+                         daemon=True).start()
+
+    def agendar(self, tarefa, atraso_ms=None):
+        self.cancelar()
+        atraso = self.atraso_ms if atraso_ms is None else atraso_ms
+        self._pendente = self.widget.after(atraso, self._disparar, tarefa)
+
+    def cancelar(self):
+        """Descarta a busca agendada e qualquer resultado ainda em andamento."""
+        if self._pendente is not None:
+            self.widget.after_cancel(self._pendente)
+            self._pendente = None
+        self._geracao += 1
+        self._interromper()
+
+    def _interromper(self):
+        con = self._con
+        if con is not None and self._executando is not None \
+                and self._executando != self._geracao:
+            con.interrupt()
+
+    def _disparar(self, tarefa):
+        self._pendente = None
+        self._geracao += 1
+        self._disparada = self._geracao
+        self._pedidos.put((self._geracao, tarefa))
+        if not self._verificando:
+            self._verificando = True
+            self.widget.after(self.INTERVALO_VERIFICACAO_MS, self._verificar)
+
+    def _trabalhar(self):
+        self._con = self.repo.conexao()
+        while True:
+            geracao, tarefa = self._pedidos.get()
+            if geracao != self._geracao:
+                continue  # ja superada enquanto esperava na fila
+            self._executando = geracao
+            try:
+                resultado = tarefa(self.repo)
+            except sqlite3.OperationalError as e:
+                # Interrupcao endereçada a consulta anterior pode atingir esta
+                if "interrupt" in str(e) and geracao == self._geracao:
+                    self._pedidos.put((geracao, tarefa))
+                else:
+                    self._resultados.put((geracao, None, e))
+            except Exception as e:
+                # Qualquer erro vai para ao_erro; a thread continua atendendo
+                self._resultados.put((geracao, None, e))
+            else:
+                self._resultados.put((geracao, resultado, None))
+            finally:
+                self._executando = None
+
+    def _verificar(self):
+        try:
+            while True:
+                geracao, resultado, erro = self._resultados.get_nowait()
+                if geracao != self._geracao:
+                    continue
+                self._recebida = geracao
+                if erro is None:
+                    self.aplicar(resultado)
+                elif self.ao_erro:
+                    self.ao_erro(erro)
+        except queue.Empty:
+            pass
+        if self._disparada == self._geracao and self._recebida != self._geracao:
+            self.widget.after(self.INTERVALO_VERIFICACAO_MS, self._verificar)
+        else:
+            self._verificando = False
 
 
 # ── Aplicacao Principal ───────────────────────────────────────────────────────
 
 class App(tk.Tk):
     def __init__(self):
+        """Monta a janela vazia; banco e primeira pagina ficam para _iniciar(),
+        que roda ja dentro do mainloop, depois da janela aparecer."""
+        self.tempos_inicio = {"import": IMPORTADO - INICIO}
+        marca = time.perf_counter()
         super().__init__()
+        self.tempos_inicio["tk"] = time.perf_counter() - marca
         self.title("Minha Biblioteca")
         self.geometry("1100x680")
         self.configure(bg=BG)
         self.minsize(900, 560)
-        init_db()
+        self.repo = RepositorioLivros()
+        marca = time.perf_counter()
         self._style()
         self._build()
-        self.carregar_livros()
+        self.tempos_inicio["interface"] = time.perf_counter() - marca
+        self.protocol("WM_DELETE_WINDOW", self._fechar)
+        self.after(0, self._iniciar)
+
+    def _iniciar(self):
+        self.update_idletasks()   # pinta a janela vazia antes de ir ao banco
+
+        marca = time.perf_counter()
+        self.repo.iniciar()
+        self.tempos_inicio["banco"] = time.perf_counter() - marca
+
+        # Primeira tela com um LIMIT pequeno; o restante da pagina vem no idle
+        marca = time.perf_counter()
+        self._atualizar_generos()
+        consulta = self._consulta_atual()
+        self._exibir_livros(self._primeira_pagina(consulta, self.repo, PRIMEIRA_TELA),
+                            PRIMEIRA_TELA)
+        self.update_idletasks()
+        self.tempos_inicio["primeira_pintura"] = time.perf_counter() - marca
+        if not self._fim:
+            self._mais_agendado = True
+            self.after_idle(self._carregar_mais)
+        self._relatar_inicio()
+        self.after(ATRASO_COPIA_MS, self._copia_agendada)
+
+    def _relatar_inicio(self):
+        tempos = self.tempos_inicio
+        total  = time.perf_counter() - INICIO
+        for fase, segundos in tempos.items():
+            MEDICAO.registrar("inicio." + fase, segundos)
+        log_inicio.info("inicializacao em %.0f ms: %s", total * 1000,
+                        ", ".join("{} {:.0f} ms".format(f, s * 1000)
+                                  for f, s in tempos.items()))
+        self.lbl_medicao.config(text="Aberto em {:.0f} ms".format(total * 1000))
+
+    def _fechar(self):
+        fechar_conexao()
+        self.destroy()
 
     def _style(self):
         s = ttk.Style(self)
@@ -470,6 +800,31 @@ class App(tk.Tk):
                   font=("Segoe UI", 10), padx=14, pady=6,
                   cursor="hand2").pack(side="right", padx=(0,4))
 
+        ferramentas = tk.Menubutton(top, text="Ferramentas",
+                                    bg=SURFACE, fg=TEXT, relief="flat",
+                                    font=("Segoe UI", 10), padx=14, pady=6,
+                                    cursor="hand2", activebackground=ACCENT2,
+                                    activeforeground="white")
+        self.menu_ferramentas = tk.Menu(ferramentas, tearoff=False,
+                                        bg=SURFACE, fg=TEXT,
+                                        activebackground=ACCENT,
+                                        activeforeground="white")
+        self.menu_ferramentas.add_command(label="Reconstruir indice de busca",
+                                          command=self._reconstruir_indice)
+        self.menu_ferramentas.add_command(label="Verificar contadores",
+                                          command=self._verificar_resumo)
+        self.menu_ferramentas.add_command(label="Exportar alteracoes...",
+                                          command=self._exportar_alteracoes)
+        self.menu_ferramentas.add_command(label="Mesclar outra biblioteca...",
+                                          command=self._mesclar)
+        self.menu_ferramentas.add_separator()
+        self.menu_ferramentas.add_command(label="Copia de seguranca...",
+                                          command=self._copiar)
+        self.menu_ferramentas.add_command(label="Copia compactada...",
+                                          command=lambda: self._copiar(True))
+        ferramentas.config(menu=self.menu_ferramentas)
+        ferramentas.pack(side="right", padx=(0,4))
+
         # Barra de filtros
         filt = tk.Frame(self, bg=BG, pady=12, padx=20)
         filt.pack(fill="x")
@@ -477,8 +832,10 @@ class App(tk.Tk):
         tk.Label(filt, text="Buscar:", bg=BG, fg=TEXT_MUTED,
                  font=("Segoe UI", 10)).pack(side="left")
 
+        self._agendador = AgendadorBusca(self, self.repo, self._exibir_livros,
+                                         self._erro_busca)
         self.busca_var = tk.StringVar()
-        self.busca_var.trace_add("write", lambda *_: self.carregar_livros())
+        self.busca_var.trace_add("write", lambda *_: self._buscar())
         tk.Entry(filt, textvariable=self.busca_var,
                  bg=SURFACE, fg=TEXT, insertbackground=TEXT,
                  relief="flat", font=("Segoe UI", 10), width=28,
@@ -489,11 +846,13 @@ class App(tk.Tk):
                  font=("Segoe UI", 10)).pack(side="left")
 
         self.genero_var = tk.StringVar(value="Todos")
-        cb = ttk.Combobox(filt, textvariable=self.genero_var,
-                          values=["Todos"] + GENEROS,
-                          state="readonly", font=("Segoe UI", 10), width=20)
-        cb.pack(side="left", padx=(6,18))
-        cb.bind("<<ComboboxSelected>>", lambda _: self.carregar_livros())
+        self._rotulos_genero = {}   # "Fantasia (1 234)" -> "Fantasia"
+        self.cb_genero = ttk.Combobox(filt, textvariable=self.genero_var,
+                                      values=["Todos"] + GENEROS,
+                                      state="readonly", font=("Segoe UI", 10),
+                                      width=24)
+        self.cb_genero.pack(side="left", padx=(6,18))
+        self.cb_genero.bind("<<ComboboxSelected>>", lambda _: self._buscar(0))
 
         tk.Label(filt, text="Lido:", bg=BG, fg=TEXT_MUTED,
                  font=("Segoe UI", 10)).pack(side="left")
@@ -503,7 +862,7 @@ class App(tk.Tk):
                             values=["Todos", "Sim", "Nao"],
                             state="readonly", font=("Segoe UI", 10), width=8)
         cb2.pack(side="left", padx=(6,0))
-        cb2.bind("<<ComboboxSelected>>", lambda _: self.carregar_livros())
+        cb2.bind("<<ComboboxSelected>>", lambda _: self._buscar(0))
 
         # Tabela
         table_frame = tk.Frame(self, bg=BG)
@@ -511,7 +870,7 @@ class App(tk.Tk):
 
         cols = ("titulo","autor","genero","ano","editora","lido","nota")
         self.tree = ttk.Treeview(table_frame, columns=cols, show="headings",
-                                  selectmode="browse")
+                                  selectmode="extended")
 
         headers = {
             "titulo":  ("Titulo",  280),
@@ -532,23 +891,36 @@ class App(tk.Tk):
         self.tree.tag_configure("even", background=ROW_EVEN)
         self.tree.tag_configure("lido", foreground=SUCCESS)
 
-        scroll = ttk.Scrollbar(table_frame, orient="vertical",
-                               command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scroll.set)
+        self._scroll = ttk.Scrollbar(table_frame, orient="vertical",
+                                     command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._ao_rolar)
         self.tree.pack(side="left", fill="both", expand=True)
-        scroll.pack(side="right", fill="y")
+        self._scroll.pack(side="right", fill="y")
 
         self.tree.bind("<Double-1>",  self._editar)
         self.tree.bind("<Delete>",    self._deletar)
         self.tree.bind("<BackSpace>", self._deletar)
+        self.tree.bind("<Control-a>", self._selecionar_tudo)
+        self.tree.bind("<Control-A>", self._selecionar_tudo)
+        self.tree.bind("<Button-3>",  self._abrir_menu_massa)
+        self.tree.bind("<<TreeviewSelect>>", self._ao_selecionar)
 
         # Barra de acoes
         bot = tk.Frame(self, bg=SURFACE, pady=8, padx=20)
         bot.pack(fill="x")
 
-        tk.Label(bot, text="Double-click para editar  |  Delete para remover",
+        tk.Label(bot, text="Double-click para editar  |  Delete para remover  |  "
+                           "Ctrl+A seleciona a lista toda",
                  bg=SURFACE, fg=TEXT_MUTED, font=("Segoe UI", 9)).pack(side="left")
 
+        self.lbl_selecao = tk.Label(bot, text="", bg=SURFACE, fg=TEXT,
+                                    font=("Segoe UI", 9))
+        self.lbl_selecao.pack(side="left", padx=(20,0))
+
+        self.lbl_medicao = tk.Label(bot, text="", bg=SURFACE, fg=TEXT_MUTED,
+                                    font=("Segoe UI", 9))
+        self.lbl_medicao.pack(side="left", padx=(20,0))
+
         tk.Button(bot, text="Editar", command=self._editar,
                   bg=SURFACE, fg=TEXT, relief="flat",
                   font=("Segoe UI", 9), padx=10, pady=4,
@@ -559,75 +931,230 @@ class App(tk.Tk):
                   font=("Segoe UI", 9), padx=10, pady=4,
                   cursor="hand2").pack(side="right")
 
+        massa = tk.Menubutton(bot, text="Selecionados", bg=SURFACE, fg=TEXT,
+                              relief="flat", font=("Segoe UI", 9), padx=10, pady=4,
+                              cursor="hand2", activebackground=ACCENT2,
+                              activeforeground="white")
+        self.menu_massa = tk.Menu(massa, tearoff=False, bg=SURFACE, fg=TEXT,
+                                  activebackground=ACCENT,
+                                  activeforeground="white")
+        self.menu_massa.add_command(label="Selecionar toda a lista",
+                                    command=self._selecionar_tudo)
+        self.menu_massa.add_separator()
+        self.menu_massa.add_command(label="Marcar como lidos",
+                                    command=lambda: self._marcar_lidos(True))
+        self.menu_massa.add_command(label="Marcar como nao lidos",
+                                    command=lambda: self._marcar_lidos(False))
+        self.menu_massa.add_command(label="Alterar genero...",
+                                    command=self._alterar_genero)
+        self.menu_massa.add_command(label="Alterar nota...",
+                                    command=self._alterar_nota)
+        self.menu_massa.add_separator()
+        self.menu_massa.add_command(label="Remover", command=self._deletar)
+        massa.config(menu=self.menu_massa)
+        massa.pack(side="right", padx=4)
+
         self._sort_col = None
         self._sort_rev = False
+        self._consulta = None
+        self._livros   = ListaLivros()
+        self._fim      = True
+        self._mais_agendado = False
+        self._selecao_total = False   # Ctrl+A: vale a consulta, nao so o carregado
+        self._copiando = False        # copia agendada em andamento
 
     # ── Dados ─────────────────────────────────────────────────────────────────
 
     def carregar_livros(self):
-        busca  = self.busca_var.get().strip()
-        genero = self.genero_var.get()
-        lido   = self.lido_var.get()
-
-        query  = "SELECT * FROM livros WHERE 1=1"
-        params = []
-
-        if busca:
-            query += " AND (titulo LIKE ? OR autor LIKE ? OR editora LIKE ?)"
-            p = "%{}%".format(busca)
-            params += [p, p, p]
-
-        if genero != "Todos":
-            query += " AND genero=?"
-            params.append(genero)
-
-        if lido == "Sim":
-            query += " AND lido=1"
-        elif lido == "Nao":
-            query += " AND lido=0"
-
-        if self._sort_col:
-            query += " ORDER BY {} {}".format(
-                self._sort_col, "DESC" if self._sort_rev else "ASC")
-        else:
-            query += " ORDER BY titulo ASC"
-
-        con = get_connection()
-        rows = con.execute(query, params).fetchall()
-        con.close()
-
-        self._livros = rows
-        self.tree.delete(*self.tree.get_children())
-
-        for i, r in enumerate(rows):
-            nota_str = "{:.1f}".format(r[7]) if r[7] is not None else "-"
-            lido_str = "v" if r[6] else "-"
-            tag = ("even" if i % 2 == 0 else "odd",)
-            if r[6]:
-                tag = ("lido",) + tag
-            self.tree.insert("", "end", iid=str(r[0]),
-                             values=(r[1], r[2], r[3], r[4] or "-",
-                                     r[5] or "-", lido_str, nota_str),
-                             tags=tag)
-
-        total = len(rows)
-        lidos = sum(1 for r in rows if r[6])
+        self._agendador.cancelar()
+        self._atualizar_generos()
+        resultado = self._primeira_pagina(self._consulta_atual(), self.repo)
+        self._exibir_livros(resultado)
+
+    def _atualizar_generos(self):
+        """Poe no combo de genero a contagem de cada um (de resumo_genero)."""
+        generos = self.repo.resumo()["generos"]
+        atual = self._genero_selecionado()
+        self._rotulos_genero = {}
+        for g in GENEROS:
+            total = generos.get(g, {}).get("total", 0)
+            rotulo = "{} ({:,})".format(g, total).replace(",", " ")
+            self._rotulos_genero[rotulo] = g
+        self.cb_genero.config(values=["Todos"] + list(self._rotulos_genero))
+        if atual is not None:
+            self.genero_var.set(next(r for r, g in self._rotulos_genero.items()
+                                     if g == atual))
+
+    def _genero_selecionado(self):
+        rotulo = self.genero_var.get()
+        if rotulo == "Todos":
+            return None
+        return self._rotulos_genero.get(rotulo, rotulo)
+
+    def _buscar(self, atraso_ms=None):
+        """Recarrega a lista em segundo plano (com debounce por padrao). Uma
+        consulta ja em cache e mostrada na hora, sem passar pelo worker."""
+        consulta = self._consulta_atual()
+        if self.repo.em_cache(consulta):
+            self._agendador.cancelar()
+            self._exibir_livros(self._primeira_pagina(consulta, self.repo))
+            return
+        self._agendador.agendar(lambda repo: self._primeira_pagina(consulta, repo),
+                                atraso_ms=atraso_ms)
+
+    def _erro_busca(self, erro):
+        messagebox.showerror("Erro na busca", str(erro), parent=self)
+
+    def _consulta_atual(self):
+        lido = self.lido_var.get()
+        return Consulta(self.busca_var.get().strip(),
+                        self._genero_selecionado(),
+                        {"Sim": True, "Nao": False}.get(lido),
+                        self._sort_col, self._sort_rev)
+
+    @staticmethod
+    def _primeira_pagina(consulta, repo, limite=TAMANHO_PAGINA):
+        with MEDICAO.registrando() as registro:
+            rows, totais = repo.primeira_pagina(consulta, limite)
+        return consulta, rows, totais, registro
+
+    def _exibir_livros(self, resultado, limite=TAMANHO_PAGINA):
+        consulta, rows, totais, registro = resultado
+        with MEDICAO.registrando(registro):
+            with MEDICAO.fase("tree.delete", len(self._livros)):
+                self.tree.delete(*self.tree.get_children())
+            self._consulta = consulta
+            self._livros   = ListaLivros()
+            self._fim      = len(rows) < limite
+            self._selecao_total = False
+            with MEDICAO.fase("tree.insert", len(rows)):
+                self._inserir_linhas(rows)
+            with MEDICAO.fase("label"):
+                self._mostrar_totais(*totais)
+        self._mostrar_medicao(registro, len(rows))
+
+    def _mostrar_medicao(self, registro, linhas):
+        """Tempo da ultima atualizacao da lista, do inicio da consulta ao fim
+        do desenho, na barra de baixo."""
+        total = registro.decorrido()
+        MEDICAO.registrar("lista.atualizacao", total, linhas,
+                          "fases: " + ", ".join(
+                              "{} {:.1f} ms".format(f, s * 1000)
+                              for f, (s, _) in registro.fases.items()))
+        self.lbl_medicao.config(
+            text="Lista atualizada em {:.0f} ms  (SQL {:.0f} ms, tela {:.0f} ms)".format(
+                total * 1000, registro.segundos("sql.") * 1000,
+                (registro.segundos("tree.") + registro.segundos("label")) * 1000))
+
+    def _mostrar_totais(self, total, lidos):
         self.lbl_total.config(
             text="{} livro{}  |  {} lido{}".format(
                 total, "s" if total != 1 else "",
                 lidos, "s" if lidos != 1 else "")
         )
 
+    @staticmethod
+    def _valores(r):
+        nota_str = "{:.1f}".format(r[7]) if r[7] is not None else "-"
+        lido_str = "v" if r[6] else "-"
+        return (r[1], r[2], r[3], r[4] or "-", r[5] or "-", lido_str, nota_str)
+
+    @staticmethod
+    def _tags(r, i):
+        tag = ("even" if i % 2 == 0 else "odd",)
+        if r[6]:
+            tag = ("lido",) + tag
+        return tag
+
+    def _inserir_linhas(self, rows):
+        inicio = len(self._livros)
+        self._livros.extend(rows)
+        for i, r in enumerate(rows, inicio):
+            self.tree.insert("", "end", iid=str(r[0]),
+                             values=self._valores(r), tags=self._tags(r, i))
+        if self._selecao_total and rows:
+            self.tree.selection_add([str(r[0]) for r in rows])
+
+    def livros_alterados(self, ids=(), removidos=()):
+        """Reflete na lista so os livros gravados ou removidos.
+
+        Cada livro em `ids` e relido e, se ainda passa pelos filtros, vai para
+        a sua posicao na ordem atual; os demais saem da lista. Livros que
+        cairiam depois da ultima pagina carregada ficam para o keyset.
+        """
+        consulta = self._consulta
+        if consulta is None or consulta.sort_col is None:
+            # Ordem por relevancia so o FTS5 sabe calcular
+            self.carregar_livros()
+            return
+
+        novos  = [(lid, self.repo.filtrado(consulta, lid)) for lid in ids]
+        totais = self.repo.totais(consulta)
+        self._atualizar_generos()
+
+        alteradas = [self._retirar(lid) for lid in removidos]
+        for lid, row in novos:
+            alteradas.append(self._retirar(lid, manter_item=row is not None))
+            if row is not None:
+                alteradas.append(self._posicionar(row))
+
+        alteradas = [i for i in alteradas if i is not None]
+        if alteradas:
+            self._listrar(min(alteradas))
+        self._mostrar_totais(*totais)
+
+    def _retirar(self, lid, manter_item=False):
+        """Tira o livro de self._livros; devolve a posicao que ele ocupava."""
+        i = self._livros.indice(lid)
+        if i is not None:
+            del self._livros[i]
+            if not manter_item:
+                self.tree.delete(str(lid))
+        return i
+
+    def _posicionar(self, row):
+        iid = str(row[0])
+        pos = self._consulta.posicao(self._livros, row)
+        if pos == len(self._livros) and not self._fim:
+            if self.tree.exists(iid):
+                self.tree.delete(iid)
+            return None
+        self._livros.insert(pos, row)
+        if self.tree.exists(iid):
+            self.tree.move(iid, "", pos)
+            self.tree.item(iid, values=self._valores(row))
+        else:
+            self.tree.insert("", pos, iid=iid, values=self._valores(row))
+        return pos
+
+    def _listrar(self, inicio):
+        """Refaz o zebrado (odd/even) a partir da primeira posicao alterada."""
+        for i in range(inicio, len(self._livros)):
+            r = self._livros[i]
+            self.tree.item(str(r[0]), tags=self._tags(r, i))
+
+    def _ao_rolar(self, primeiro, ultimo):
+        self._scroll.set(primeiro, ultimo)
+        if float(ultimo) >= 0.9 and not self._fim and not self._mais_agendado:
+            self._mais_agendado = True
+            self.after_idle(self._carregar_mais)
+
+    def _carregar_mais(self):
+        """Busca a proxima pagina da consulta atual e acrescenta na lista."""
+        self._mais_agendado = False
+        if self._fim or self._consulta is None:
+            return
+        ultima = self._livros[-1] if self._livros else None
+        rows = self.repo.pagina(self._consulta, ultima, len(self._livros))
+        self._fim = len(rows) < TAMANHO_PAGINA
+        self._inserir_linhas(rows)
+
     def _livro_selecionado(self):
         sel = self.tree.selection()
         if not sel:
             messagebox.showinfo("Selecione", "Selecione um livro na lista.")
             return None
-        lid = int(sel[0])
-        con = get_connection()
-        row = con.execute("SELECT * FROM livros WHERE id=?", (lid,)).fetchone()
-        con.close()
-        return row
+        return self.repo.obter(int(sel[0]))
 
     def _novo(self):
         JanelaCadastro(self)
@@ -641,31 +1168,18 @@ class App(tk.Tk):
         if not path:
             return
 
-        # Detectar encoding
-        for enc in ("utf-8-sig", "utf-8", "latin-1", "cp1252"):
-            try:
-                with open(path, newline="", encoding=enc) as f:
-                    sample = f.read(1024)
-                encoding = enc
-                break
-            except UnicodeDecodeError:
-                continue
-
         try:
-            with open(path, newline="", encoding=encoding) as f:
-                reader = csv.DictReader(f)
-                colunas = reader.fieldnames or []
-                rows = list(reader)
+            formato, colunas, amostra = amostra_csv(path, AMOSTRA_CSV)
         except Exception as e:
             messagebox.showerror("Erro ao ler CSV",
                                  "Nao foi possivel abrir o arquivo:\n{}".format(str(e)))
             return
 
-        if not rows:
+        if not amostra:
             messagebox.showwarning("CSV vazio", "O arquivo nao contem linhas de dados.")
             return
 
-        JanelaCSV(self, rows, colunas)
+        JanelaCSV(self, path, formato, colunas, amostra)
 
     def _editar(self, event=None):
         livro = self._livro_selecionado()
@@ -673,15 +1187,104 @@ class App(tk.Tk):
             JanelaCadastro(self, livro)
 
     def _deletar(self, event=None):
-        livro = self._livro_selecionado()
-        if not livro:
+        alvo = self._alvo()
+        if alvo is None:
             return
-        if messagebox.askyesno("Confirmar", 'Remover "{}"?'.format(livro[1]), parent=self):
-            con = get_connection()
-            con.execute("DELETE FROM livros WHERE id=?", (livro[0],))
-            con.commit()
-            con.close()
-            self.carregar_livros()
+        if isinstance(alvo, list) and len(alvo) == 1:
+            pergunta = 'Remover "{}"?'.format(
+                self._livros[self._livros.indice(alvo[0])][1])
+        else:
+            pergunta = "Remover {} livros?".format(self._quantos(alvo))
+        if messagebox.askyesno("Confirmar", pergunta, parent=self):
+            self._em_massa(alvo, lambda repo: repo.remover_varios(alvo),
+                           remocao=True)
+
+    # ── Selecao e operacoes em massa ──────────────────────────────────────────
+
+    def _selecionar_tudo(self, event=None):
+        """Seleciona todos os livros da consulta atual, inclusive os das
+        paginas ainda nao carregadas (que entram selecionadas)."""
+        if not self._livros:
+            return "break"
+        self._selecao_total = True
+        self.tree.selection_set(self.tree.get_children())
+        return "break"
+
+    def _ao_selecionar(self, event=None):
+        # Clicar muda a selecao; a de Ctrl+A so vale enquanto cobre a lista
+        if self._selecao_total and len(self.tree.selection()) != len(self._livros):
+            self._selecao_total = False
+        n = self._quantos(self._alvo(avisar=False) or [])
+        self.lbl_selecao.config(
+            text="" if n < 2 else "{:,} selecionados".format(n).replace(",", " "))
+
+    def _alvo(self, avisar=True):
+        """Livros das operacoes em massa: a Consulta atual depois de Ctrl+A,
+        senao a lista de ids selecionados; None sem selecao."""
+        if self._selecao_total:
+            return self._consulta
+        ids = [int(iid) for iid in self.tree.selection()]
+        if not ids:
+            if avisar:
+                messagebox.showinfo("Selecione", "Selecione um livro na lista.")
+            return None
+        return ids
+
+    def _quantos(self, alvo):
+        if isinstance(alvo, Consulta):
+            return self.repo.totais(alvo)[0]
+        return len(alvo)
+
+    def _abrir_menu_massa(self, event):
+        iid = self.tree.identify_row(event.y)
+        if iid and iid not in self.tree.selection():
+            self.tree.selection_set(iid)
+        self.menu_massa.tk_popup(event.x_root, event.y_root)
+
+    def _marcar_lidos(self, lido):
+        alvo = self._alvo()
+        if alvo is not None:
+            self._em_massa(alvo, lambda repo: repo.alterar_varios(alvo, lido=lido))
+
+    def _alterar_genero(self):
+        alvo = self._alvo()
+        if alvo is not None:
+            JanelaEscolha(self, "Alterar genero",
+                          "Genero de {} livro(s)".format(self._quantos(alvo)),
+                          lambda g: self._em_massa(
+                              alvo, lambda repo: repo.alterar_varios(alvo, genero=g)),
+                          opcoes=GENEROS)
+
+    def _alterar_nota(self):
+        alvo = self._alvo()
+        if alvo is not None:
+            JanelaEscolha(self, "Alterar nota",
+                          "Nota (0-10) de {} livro(s)".format(self._quantos(alvo)),
+                          lambda n: self._em_massa(
+                              alvo, lambda repo: repo.alterar_varios(alvo, nota=n)))
+
+    def _em_massa(self, alvo, funcao, remocao=False):
+        """Roda `funcao(repo)` (uma transacao) fora do Tk e atualiza a lista
+        uma vez no fim: so as linhas afetadas quando sao poucas, senao tudo."""
+        self.config(cursor="watch")
+
+        def concluir(_):
+            self.config(cursor="")
+            if isinstance(alvo, Consulta) or len(alvo) > LIMITE_ATUALIZACAO_LOCAL:
+                self.carregar_livros()
+            elif remocao:
+                self.livros_alterados(removidos=alvo)
+            else:
+                self.livros_alterados(alvo)
+                self.tree.selection_set([str(i) for i in alvo
+                                         if self.tree.exists(str(i))])
+
+        def falhar(erro):
+            self.config(cursor="")
+            messagebox.showerror("Erro", str(erro), parent=self)
+
+        TarefaSegundoPlano(self, lambda p, c: funcao(self.repo),
+                           ao_concluir=concluir, ao_falhar=falhar)
 
     def _ordenar(self, col):
         if self._sort_col == col:
@@ -689,9 +1292,39 @@ class App(tk.Tk):
         else:
             self._sort_col = col
             self._sort_rev = False
+        self._buscar(0)
+
+    def _reconstruir_indice(self):
+        reconstruir_indice_busca(self.repo.arquivo)
         self.carregar_livros()
+        messagebox.showinfo("Indice de busca", "Indice de busca reconstruido.")
+
+    def _verificar_resumo(self):
+        divergentes = self.repo.verificar_resumo()
+        if not divergentes:
+            messagebox.showinfo("Contadores", "Os contadores conferem com a biblioteca.")
+            return
+        generos = ", ".join(g for g, _, _ in divergentes)
+        if messagebox.askyesno(
+                "Contadores",
+                "Contadores divergentes em: {}.\n\nReconstruir a partir dos livros?"
+                .format(generos), parent=self):
+            self.repo.reconstruir_resumo()
+            self.carregar_livros()
 
     def _exportar(self):
+        consulta = Consulta()
+        atual = self._consulta
+        if atual is not None and (atual.expr or atual.genero or atual.lido is not None):
+            resp = messagebox.askyesnocancel(
+                "Exportar CSV",
+                "Exportar apenas os livros da lista atual (busca e filtros)?\n\n"
+                "Nao = exportar a biblioteca inteira.", parent=self)
+            if resp is None:
+                return
+            if resp:
+                consulta = atual
+
         path = filedialog.asksaveasfilename(
             defaultextension=".csv",
             filetypes=[("CSV", "*.csv")],
@@ -700,22 +1333,129 @@ class App(tk.Tk):
         )
         if not path:
             return
-        con = get_connection()
-        rows = con.execute(
-            "SELECT titulo,autor,genero,ano,editora,lido,nota,obs,criado_em "
-            "FROM livros ORDER BY titulo").fetchall()
-        con.close()
-        with open(path, "w", newline="", encoding="utf-8-sig") as f:
-            w = csv.writer(f)
-            w.writerow(["Titulo","Autor","Genero","Ano","Editora",
-                        "Lido","Nota","Observacoes","Cadastrado em"])
-            for r in rows:
-                w.writerow([r[0], r[1], r[2], r[3] or "", r[4] or "",
-                            "Sim" if r[5] else "Nao",
-                            r[6] if r[6] is not None else "", r[7] or "", r[8]])
-        messagebox.showinfo("Exportado", "Arquivo salvo em:\n{}".format(path))
+
+        self._exportar_com_progresso(
+            lambda p, c: self.repo.exportar(path, consulta, p, c),
+            lambda feitos: "{} livro(s) salvo(s) em:\n{}".format(feitos, path))
+
+    def _exportar_alteracoes(self):
+        """Exporta so o que mudou desde a ultima exportacao incremental."""
+        marca = self.repo.marca_exportacao()
+        path = filedialog.asksaveasfilename(
+            title="Exportar alteracoes desde " + (marca[:19] + " UTC" if marca
+                                                  else "o inicio"),
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv")],
+            initialfile="biblioteca_alteracoes_{}.csv".format(
+                datetime.now().strftime("%Y%m%d_%H%M"))
+        )
+        if not path:
+            return
+
+        self._exportar_com_progresso(
+            lambda p, c: self.repo.exportar_alteracoes(path, progresso=p, cancelado=c),
+            lambda res: "{} livro(s) gravado(s) e {} removido(s) salvos em:\n{}"
+                        .format(res["gravados"], res["removidos"], path))
+
+    def _mesclar(self):
+        """Traz os livros de outro arquivo de biblioteca (repo.mesclar)."""
+        path = filedialog.askopenfilename(
+            title="Biblioteca a mesclar",
+            filetypes=[("Banco SQLite", "*.db"), ("Todos", "*.*")]
+        )
+        if not path:
+            return
+        politicas = {"Manter os meus": "meus",
+                     "Usar os da outra biblioteca": "deles",
+                     "Manter o alterado por ultimo": "recente"}
+        JanelaEscolha(self, "Mesclar biblioteca",
+                      "Livros repetidos: nota, lido e obs",
+                      lambda rotulo: self._rodar_mescla(path, politicas[rotulo]),
+                      opcoes=list(politicas))
+
+    def _rodar_mescla(self, path, politica):
+        self.config(cursor="watch")
+
+        def concluir(res):
+            self.config(cursor="")
+            self.carregar_livros()
+            messagebox.showinfo(
+                "Mesclar biblioteca",
+                "{total} livro(s) na outra biblioteca ({repetidos} repetido(s) "
+                "la): {novos} novo(s) e {existentes} que ja estava(m) aqui, "
+                "{atualizados} atualizado(s).".format(**res),
+                parent=self)
+
+        def falhar(erro):
+            self.config(cursor="")
+            messagebox.showerror("Erro ao mesclar", str(erro), parent=self)
+
+        TarefaSegundoPlano(self, lambda p, c: self.repo.mesclar(path, politica),
+                           ao_concluir=concluir, ao_falhar=falhar)
+
+    def _copiar(self, compactar=False):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".db",
+            filetypes=[("Banco SQLite", "*.db")],
+            initialfile="biblioteca_copia_{}.db".format(
+                datetime.now().strftime("%Y%m%d_%H%M"))
+        )
+        if not path:
+            return
+
+        self._exportar_com_progresso(
+            lambda p, c: self.repo.copiar(path, compactar, p, c),
+            lambda tamanho: "Copia de {:.1f} MB salva em:\n{}".format(
+                tamanho / 1e6, path),
+            "Copiando banco", "paginas", "Copia salva", "Erro ao copiar")
+
+    def _copia_agendada(self):
+        """Grava a copia agendada em segundo plano se a ultima ja venceu, sem
+        interromper o usuario; confere de novo a cada VERIFICAR_COPIA_MS."""
+        self.after(VERIFICAR_COPIA_MS, self._copia_agendada)
+        if self._copiando or not self.repo.copia_vencida():
+            return
+        self._copiando = True
+
+        def concluir(destino):
+            self._copiando = False
+
+        def falhar(erro):
+            self._copiando = False
+            log_copias.warning("copia agendada falhou: %s", erro)
+
+        TarefaSegundoPlano(self, lambda p, c: self.repo.fazer_copia_agendada(
+                               cancelado=c),
+                           ao_concluir=concluir, ao_falhar=falhar)
+
+    def _exportar_com_progresso(self, funcao, mensagem, titulo="Exportando CSV",
+                                unidade="livro(s)", titulo_ok="Exportado",
+                                titulo_erro="Erro ao exportar"):
+        janela = JanelaProgresso(self, titulo)
+
+        def progresso(feitos, total):
+            janela.atualizar(feitos, total,
+                             "{} de {} {}".format(feitos, total, unidade))
+
+        def concluir(resultado):
+            janela.destroy()
+            if resultado is not None:
+                messagebox.showinfo(titulo_ok, mensagem(resultado))
+
+        def falhar(erro):
+            janela.destroy()
+            messagebox.showerror(titulo_erro, str(erro))
+
+        janela.tarefa = TarefaSegundoPlano(
+            self, funcao, ao_progresso=progresso, ao_concluir=concluir,
+            ao_falhar=falhar)
+
+IMPORTADO = time.perf_counter()
 
 # ── Iniciar ───────────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
+    if DIAGNOSTICO_PLANOS or os.environ.get("BIBLIOTECA_INICIO"):
+        logging.basicConfig(level=logging.INFO)
+    ativar_log_lentas()
     App().mainloop()
@@ -0,0 +1,2378 @@
+"""Dados da biblioteca: banco SQLite, consultas da lista, importacao e
+exportacao CSV. Nao depende do tkinter; a janela (biblioteca_3.py), scripts
+e threads de trabalho usam o RepositorioLivros daqui.
+
+Rodado direto e a linha de comando (python biblioteca_dados.py --help)."""
+
+import argparse
+import sqlite3
+import codecs
+import csv
+import json
+import mmap
+import re
+import logging
+import logging.handlers
+import multiprocessing
+import threading
+import os
+import sys
+import time
+import unicodedata
+import weakref
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import count, islice
+from functools import lru_cache
+
+# ── Banco de Dados ────────────────────────────────────────────────────────────
+
+DB_FILE = "biblioteca.db"
+
+TAMANHO_PAGINA  = 200   # linhas buscadas por vez na lista
+TAMANHO_LOTE    = 2000  # linhas por transacao na importacao
+CHAVE_UNICA     = False # impede no banco dois livros com a mesma chave
+LIMITE_PARALELO = 64 * 1024 * 1024  # CSVs a partir disso usam varios processos
+TAMANHO_TRECHO  = 8 * 1024 * 1024   # bytes do CSV por tarefa do pool
+LIMITE_CACHE_BYTES = 32 * 1024 * 1024  # resultados guardados pelo CacheConsultas
+
+COLUNAS = ("id", "titulo", "autor", "genero", "ano", "editora",
+           "lido", "nota", "obs", "criado_em", "chave", "atualizado_em")
+COLUNAS_LISTA = COLUNAS[:8]   # as que a lista mostra, nas mesmas posicoes
+COLUNAS_ORDENACAO = ("titulo", "autor", "genero", "ano", "editora", "lido", "nota")
+COLUNAS_TEXTO     = ("titulo", "autor", "editora")  # ordenadas com NOCASE
+COLUNAS_OBRIGATORIAS = ("titulo", "autor", "genero")  # NOT NULL no banco
+
+# BIBLIOTECA_PLANOS=1 registra o EXPLAIN QUERY PLAN de cada consulta da lista
+DIAGNOSTICO_PLANOS = bool(os.environ.get("BIBLIOTECA_PLANOS"))
+PLANOS = {}
+log_planos = logging.getLogger("biblioteca.planos")
+
+# Operacoes a partir deste tempo vao para o log "biblioteca.lentas"
+LIMITE_LENTO_MS = float(os.environ.get("BIBLIOTECA_LENTO_MS", 200))
+ARQUIVO_LENTAS  = "biblioteca_lentas.log"
+log_lentas = logging.getLogger("biblioteca.lentas")
+log_lentas.addHandler(logging.NullHandler())  # mudo ate ativar_log_lentas()
+
+# Suba a cada mudanca no que init_db cria; o numero fica no PRAGMA user_version
+VERSAO_ESQUEMA = 3
+
+# Momento das alteracoes (atualizado_em, removido_em): UTC com milissegundos,
+# para a marca da exportacao incremental nao voltar atras no horario de verao
+AGORA_UTC = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def _versao_esquema():
+    # O indice unico da chave depende de CHAVE_UNICA, entao entra na versao
+    return VERSAO_ESQUEMA * 2 + (1 if CHAVE_UNICA else 0)
+
+def init_db(arquivo=None):
+    """Cria ou atualiza o esquema. Se o banco ja esta na versao atual so
+    completa chaves que faltem (uma busca no indice), sem refazer nada."""
+    con = get_connection(arquivo)
+    if con.execute("PRAGMA user_version").fetchone()[0] == _versao_esquema():
+        if con.execute("SELECT 1 FROM livros WHERE chave IS NULL LIMIT 1").fetchone():
+            con.execute("UPDATE livros SET chave = chave_livro(titulo, autor) "
+                        "WHERE chave IS NULL")
+        return
+
+    cur = con.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS livros (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo    TEXT NOT NULL,
+            autor     TEXT NOT NULL,
+            genero    TEXT NOT NULL,
+            ano       INTEGER,
+            editora   TEXT,
+            lido      INTEGER DEFAULT 0,
+            nota      REAL,
+            obs       TEXT,
+            criado_em TEXT DEFAULT (datetime('now','localtime')),
+            chave     TEXT,
+            atualizado_em TEXT DEFAULT ({})
+        )
+    """.format(AGORA_UTC))
+    _criar_chave(cur)
+    _criar_indices_lista(cur)
+    _criar_indice_busca(cur)
+    _criar_resumo(cur)
+    _criar_alteracoes(cur)
+    cur.execute("PRAGMA user_version = {}".format(_versao_esquema()))
+
+def _colunas(cur, tabela):
+    return [r[1] for r in cur.execute("PRAGMA table_info({})".format(tabela))]
+
+def _criar_chave(cur):
+    """Coluna chave (titulo + autor normalizados) usada contra duplicatas.
+
+    Bancos antigos ganham a coluna e tem a chave preenchida aqui; livros
+    gravados por outros programas sem a chave tambem sao completados.
+    """
+    if "chave" not in _colunas(cur, "livros"):
+        cur.execute("ALTER TABLE livros ADD COLUMN chave TEXT")
+    cur.execute("UPDATE livros SET chave = chave_livro(titulo, autor) "
+                "WHERE chave IS NULL")
+
+    if CHAVE_UNICA:
+        try:
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_livros_chave_unica "
+                        "ON livros(chave)")
+        except sqlite3.IntegrityError:
+            pass  # ja ha duplicatas gravadas; fica o indice comum
+        else:
+            cur.execute("DROP INDEX IF EXISTS idx_livros_chave")
+            return
+    else:
+        cur.execute("DROP INDEX IF EXISTS idx_livros_chave_unica")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_livros_chave ON livros(chave)")
+
+def indices_lista():
+    """{nome: colunas} dos indices que servem a ordenacao da lista.
+
+    Para cada coluna ordenavel ha um indice so dela, um (lido, coluna), um
+    (genero, coluna) e um (genero, lido, coluna): os filtros de igualdade
+    vem antes e a coluna de ordenacao (NOCASE nos textos) depois, com o
+    rowid implicito no fim como desempate. Toda combinacao de filtros tem
+    assim um indice ja na ordem, e o plano nao depende de estatisticas.
+    """
+    indices = {}
+    for col in COLUNAS_ORDENACAO:
+        expr = col + " COLLATE NOCASE" if col in COLUNAS_TEXTO else col
+        for prefixo in ((), ("lido",), ("genero",), ("genero", "lido")):
+            nomes  = list(prefixo) + ([col] if col not in prefixo else [])
+            partes = list(prefixo) + ([expr] if col not in prefixo else [])
+            indices["idx_ord_" + "_".join(nomes)] = ", ".join(partes)
+    return indices
+
+def _criar_indices_lista(cur):
+    esperados = indices_lista()
+    existentes = [r[0] for r in cur.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_ord_%'")]
+    for nome in existentes:
+        if nome not in esperados:
+            cur.execute("DROP INDEX {}".format(nome))
+    for nome, colunas in esperados.items():
+        cur.execute("CREATE INDEX IF NOT EXISTS {} ON livros({})".format(nome, colunas))
+
+    # As estatisticas so ajudam a escolher entre indices que ja servem a
+    # ordem (p.ex. genero raro); o ANALYZE inicial as cria e o PRAGMA
+    # optimize de fechar_conexao() as mantem em dia.
+    tem_stat1 = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+    sem_estatisticas = not tem_stat1 or cur.execute(
+        "SELECT 1 FROM sqlite_stat1 WHERE tbl='livros' LIMIT 1").fetchone() is None
+    if sem_estatisticas and cur.execute("SELECT 1 FROM livros LIMIT 1").fetchone():
+        cur.execute("ANALYZE livros")
+
+def chave_unica(con):
+    """True se o banco tem o indice unico sobre a chave."""
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='index' "
+                       "AND name='idx_livros_chave_unica'").fetchone() is not None
+
+def _normalizar_texto(texto):
+    texto = unicodedata.normalize("NFKD", texto.casefold())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+def chave_livro(titulo, autor):
+    """Chave de duplicidade: titulo e autor sem caixa, acentos nem espacos
+    repetidos ("O  Cortiço", "o cortico" dao a mesma chave)."""
+    if titulo is None or autor is None:
+        return None
+    return _normalizar_texto(titulo) + "\x1f" + _normalizar_texto(autor)
+
+def _criar_indice_busca(cur):
+    """Cria o indice FTS5 sobre titulo/autor/editora/obs e os triggers que o
+    mantem sincronizado com a tabela livros."""
+    existia = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='livros_fts'"
+    ).fetchone()
+    cur.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS livros_fts USING fts5(
+            titulo, autor, editora, obs,
+            content='livros', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS livros_fts_ai AFTER INSERT ON livros BEGIN
+            INSERT INTO livros_fts (rowid, titulo, autor, editora, obs)
+            VALUES (new.id, new.titulo, new.autor, new.editora, new.obs);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS livros_fts_ad AFTER DELETE ON livros BEGIN
+            INSERT INTO livros_fts (livros_fts, rowid, titulo, autor, editora, obs)
+            VALUES ('delete', old.id, old.titulo, old.autor, old.editora, old.obs);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS livros_fts_au
+        AFTER UPDATE OF titulo, autor, editora, obs ON livros BEGIN
+            INSERT INTO livros_fts (livros_fts, rowid, titulo, autor, editora, obs)
+            VALUES ('delete', old.id, old.titulo, old.autor, old.editora, old.obs);
+            INSERT INTO livros_fts (rowid, titulo, autor, editora, obs)
+            VALUES (new.id, new.titulo, new.autor, new.editora, new.obs);
+        END;
+    """)
+    if not existia:
+        # Titulo pesa mais que autor, que pesa mais que editora e obs
+        cur.execute("INSERT INTO livros_fts (livros_fts, rank) "
+                    "VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')")
+        cur.execute("INSERT INTO livros_fts (livros_fts) VALUES ('rebuild')")
+
+def reconstruir_indice_busca(arquivo=None):
+    """Reconstroi o indice de busca a partir da tabela livros."""
+    with transacao(arquivo) as con:
+        con.execute("INSERT INTO livros_fts (livros_fts) VALUES ('rebuild')")
+
+def _criar_resumo(cur):
+    """Cria a tabela resumo_genero e os triggers que a mantem em dia.
+
+    Uma linha por genero com total de livros, lidos e soma/quantidade de
+    notas, entao os totais da biblioteca (ou de um genero) saem somando no
+    maximo uma linha por genero, sem percorrer livros.
+    """
+    existia = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='resumo_genero'"
+    ).fetchone()
+    cur.executescript("""
+        CREATE TABLE IF NOT EXISTS resumo_genero (
+            genero    TEXT PRIMARY KEY,
+            total     INTEGER NOT NULL DEFAULT 0,
+            lidos     INTEGER NOT NULL DEFAULT 0,
+            soma_nota REAL    NOT NULL DEFAULT 0,
+            com_nota  INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TRIGGER IF NOT EXISTS resumo_ai AFTER INSERT ON livros BEGIN
+            INSERT INTO resumo_genero (genero, total, lidos, soma_nota, com_nota)
+            VALUES (new.genero, 1, COALESCE(new.lido, 0) <> 0,
+                    COALESCE(new.nota, 0), new.nota IS NOT NULL)
+            ON CONFLICT(genero) DO UPDATE SET
+                total     = total + 1,
+                lidos     = lidos + excluded.lidos,
+                soma_nota = soma_nota + excluded.soma_nota,
+                com_nota  = com_nota + excluded.com_nota;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS resumo_ad AFTER DELETE ON livros BEGIN
+            UPDATE resumo_genero SET
+                total     = total - 1,
+                lidos     = lidos - (COALESCE(old.lido, 0) <> 0),
+                soma_nota = soma_nota - COALESCE(old.nota, 0),
+                com_nota  = com_nota - (old.nota IS NOT NULL)
+            WHERE genero = old.genero;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS resumo_au
+        AFTER UPDATE OF genero, lido, nota ON livros BEGIN
+            UPDATE resumo_genero SET
+                total     = total - 1,
+                lidos     = lidos - (COALESCE(old.lido, 0) <> 0),
+                soma_nota = soma_nota - COALESCE(old.nota, 0),
+                com_nota  = com_nota - (old.nota IS NOT NULL)
+            WHERE genero = old.genero;
+            INSERT INTO resumo_genero (genero, total, lidos, soma_nota, com_nota)
+            VALUES (new.genero, 1, COALESCE(new.lido, 0) <> 0,
+                    COALESCE(new.nota, 0), new.nota IS NOT NULL)
+            ON CONFLICT(genero) DO UPDATE SET
+                total     = total + 1,
+                lidos     = lidos + excluded.lidos,
+                soma_nota = soma_nota + excluded.soma_nota,
+                com_nota  = com_nota + excluded.com_nota;
+        END;
+    """)
+    if not existia:
+        cur.execute(_RECALCULAR_RESUMO)
+
+_CONTAR_GENEROS = """
+    SELECT genero, COUNT(*), SUM(COALESCE(lido, 0) <> 0),
+           COALESCE(SUM(nota), 0), COUNT(nota)
+    FROM livros GROUP BY genero
+"""
+_RECALCULAR_RESUMO = ("INSERT INTO resumo_genero "
+                      "(genero, total, lidos, soma_nota, com_nota)" + _CONTAR_GENEROS)
+
+def reconstruir_resumo(arquivo=None):
+    """Refaz resumo_genero a partir da tabela livros."""
+    with transacao(arquivo) as con:
+        con.execute("DELETE FROM resumo_genero")
+        con.execute(_RECALCULAR_RESUMO)
+
+def verificar_resumo(arquivo=None):
+    """Compara resumo_genero com uma contagem direta de livros.
+
+    Devolve (genero, gravado, esperado) para cada genero divergente, com
+    (total, lidos, soma_nota, com_nota) nos dois lados; lista vazia se
+    estiver tudo certo. A soma das notas tolera o erro de arredondamento
+    acumulado pelos triggers.
+    """
+    con = get_connection(arquivo)
+    gravado = {r[0]: r[1:] for r in con.execute(
+        "SELECT genero, total, lidos, soma_nota, com_nota FROM resumo_genero "
+        "WHERE total <> 0 OR com_nota <> 0")}
+    esperado = {r[0]: r[1:] for r in con.execute(_CONTAR_GENEROS)}
+    divergentes = []
+    for genero in sorted(set(gravado) | set(esperado)):
+        g = gravado.get(genero, (0, 0, 0.0, 0))
+        e = esperado.get(genero, (0, 0, 0.0, 0))
+        if (g[0], g[1], g[3]) != (e[0], e[1], e[3]) or \
+                abs(g[2] - e[2]) > 1e-6 * max(1.0, abs(e[2])):
+            divergentes.append((genero, g, e))
+    return divergentes
+
+def contagem_resumo(con, genero=None, lido=None):
+    """(total, lidos) da biblioteca ou de um genero, lidos de resumo_genero,
+    no mesmo formato de Consulta.contagem()."""
+    sql = "SELECT COALESCE(SUM(total), 0), COALESCE(SUM(lidos), 0) FROM resumo_genero"
+    params = ()
+    if genero:
+        sql += " WHERE genero=?"
+        params = (genero,)
+    total, lidos = con.execute(sql, params).fetchone()
+    if lido is None:
+        return total, lidos
+    return (lidos, lidos) if lido else (total - lidos, 0)
+
+def _criar_alteracoes(cur):
+    """Registro de alteracoes para a exportacao incremental.
+
+    livros.atualizado_em e posto pelos triggers em toda gravacao (bancos
+    antigos ganham a coluna sem DEFAULT, dai o trigger de insercao), e cada
+    livro apagado deixa uma lapide em livros_removidos. Os dois tem indice
+    pelo momento, que e por onde exportar_alteracoes() le.
+    """
+    if "atualizado_em" not in _colunas(cur, "livros"):
+        cur.execute("ALTER TABLE livros ADD COLUMN atualizado_em TEXT")
+        cur.execute("UPDATE livros SET atualizado_em = COALESCE("
+                    "strftime('%Y-%m-%d %H:%M:%f', criado_em, 'utc'), {})"
+                    .format(AGORA_UTC))
+    cur.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_livros_atualizado ON livros(atualizado_em);
+
+        CREATE TABLE IF NOT EXISTS livros_removidos (
+            id          INTEGER PRIMARY KEY,
+            titulo      TEXT,
+            autor       TEXT,
+            chave       TEXT,
+            removido_em TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_removidos_momento
+            ON livros_removidos(removido_em);
+
+        CREATE TABLE IF NOT EXISTS marcas_exportacao (
+            destino      TEXT PRIMARY KEY,
+            marca        TEXT NOT NULL,
+            exportado_em TEXT NOT NULL
+        );
+
+        CREATE TRIGGER IF NOT EXISTS alteracao_ai AFTER INSERT ON livros
+        WHEN new.atualizado_em IS NULL BEGIN
+            UPDATE livros SET atualizado_em = {0} WHERE id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS alteracao_au AFTER UPDATE ON livros
+        WHEN new.atualizado_em IS old.atualizado_em BEGIN
+            UPDATE livros SET atualizado_em = {0} WHERE id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS alteracao_ad AFTER DELETE ON livros BEGIN
+            INSERT OR REPLACE INTO livros_removidos
+                (id, titulo, autor, chave, removido_em)
+            VALUES (old.id, old.titulo, old.autor, old.chave, {0});
+        END;
+    """.format(AGORA_UTC))
+
+def expressao_busca(texto):
+    """Converte o texto digitado no campo Buscar numa expressao MATCH do FTS5.
+
+    Trechos entre aspas viram frases exatas; as demais palavras sao buscadas
+    por prefixo ("tolk" encontra "Tolkien"). Retorna None se nao sobrar termo.
+    """
+    termos = []
+    for frase, palavra in re.findall(r'"([^"]*)"?|(\S+)', texto):
+        termo = frase or palavra
+        if not re.search(r"\w", termo):
+            continue
+        termo = '"{}"'.format(termo.replace('"', '""'))
+        termos.append(termo + "*" if palavra else termo)
+    return " ".join(termos) or None
+
+# Colunas lidas pelas paginas da lista: obs, criado_em e chave ficam no banco
+SELECT_LISTA = "SELECT " + ", ".join("l." + c for c in COLUNAS_LISTA)
+
+class Consulta:
+    """Filtros e ordenacao da lista de livros, com paginacao por keyset.
+
+    Ordenando por coluna, cada pagina continua a partir do par (coluna, id)
+    da ultima linha carregada, entao o custo nao cresce com a posicao na
+    lista. Uma busca textual sem coluna escolhida ordena pelo rank do FTS5 e
+    pagina por OFFSET, que so percorre os livros encontrados.
+    """
+
+    def __init__(self, busca="", genero=None, lido=None,
+                 sort_col=None, sort_rev=False):
+        self.expr     = expressao_busca(busca)
+        self.genero   = genero
+        self.lido     = lido
+        self.sort_rev = sort_rev
+        if sort_col is None and not self.expr:
+            sort_col = "titulo"
+        self.sort_col = sort_col
+
+    def _filtro(self):
+        sql    = " FROM livros l"
+        params = []
+
+        if self.expr:
+            sql += " JOIN livros_fts f ON f.rowid = l.id AND livros_fts MATCH ?"
+            params.append(self.expr)
+
+        sql += " WHERE 1=1"
+
+        if self.genero:
+            sql += " AND l.genero=?"
+            params.append(self.genero)
+
+        if self.lido is not None:
+            sql += " AND l.lido={}".format(1 if self.lido else 0)
+
+        return sql, params
+
+    def _coluna(self):
+        """Expressao de ordenacao: texto ordena sem diferenciar caixa."""
+        col = "l." + self.sort_col
+        return col + " COLLATE NOCASE" if self.sort_col in COLUNAS_TEXTO else col
+
+    def _fixa(self):
+        """True se o filtro fixa a coluna ordenada (genero=?, lido=?): a
+        ordem vira so a do id."""
+        return ((self.sort_col == "genero" and bool(self.genero)) or
+                (self.sort_col == "lido" and self.lido is not None))
+
+    def _ordem(self):
+        if self.sort_col is None:
+            return " ORDER BY f.rank, l.id"
+        direcao = "DESC" if self.sort_rev else "ASC"
+        return " ORDER BY {0} {1}, l.id {1}".format(self._coluna(), direcao)
+
+    def sql(self, colunas="l.*"):
+        """Consulta completa, sem paginacao."""
+        filtro, params = self._filtro()
+        return "SELECT " + colunas + filtro + self._ordem(), params
+
+    def contagem(self):
+        filtro, params = self._filtro()
+        return "SELECT COUNT(*), COALESCE(SUM(l.lido), 0)" + filtro, params
+
+    def ids(self):
+        """Ids de todos os livros que passam pelos filtros, sem ordem (para
+        as gravacoes em massa)."""
+        filtro, params = self._filtro()
+        return "SELECT l.id" + filtro, params
+
+    def por_id(self, lid):
+        """O livro `lid`, se ele passar pelos filtros desta consulta."""
+        filtro, params = self._filtro()
+        return SELECT_LISTA + filtro + " AND l.id=?", params + [lid]
+
+    def chave(self, row):
+        """Chave Python equivalente ao ORDER BY (NULL < numeros < texto)."""
+        valor = row[COLUNAS.index(self.sort_col)]
+        if valor is None:
+            return (0, 0, row[0])
+        if isinstance(valor, (int, float)):
+            return (1, valor, row[0])
+        if self.sort_col in COLUNAS_TEXTO:
+            valor = valor.translate(_NOCASE)
+        return (2, valor, row[0])
+
+    def posicao(self, rows, row):
+        """Indice em que `row` entra em `rows`, ja ordenadas por esta consulta."""
+        chave = self.chave(row)
+        lo, hi = 0, len(rows)
+        while lo < hi:
+            meio = (lo + hi) // 2
+            outra = self.chave(rows[meio])
+            if (outra > chave) if self.sort_rev else (outra < chave):
+                lo = meio + 1
+            else:
+                hi = meio
+        return lo
+
+    def identidade(self):
+        """O que define o resultado desta consulta (chave do CacheConsultas)."""
+        return (self.expr, self.genero, self.lido, self.sort_col, self.sort_rev)
+
+    def pagina(self, ultima=None, carregados=0, limite=TAMANHO_PAGINA):
+        """Consultas, em ordem, que trazem a pagina seguinte a `ultima`.
+
+        No indice os NULL ficam antes de tudo (e por ultimo lendo de tras
+        para frente, em DESC). Um OR juntando os dois lados impediria o uso
+        do indice, entao a continuacao que cruza essa fronteira vira duas
+        consultas: buscar_pagina() so roda a segunda se a primeira nao
+        completar a pagina. O limite extra `col >= ?` antes do row value
+        deixa o SQLite posicionar no indice mesmo com COLLATE NOCASE.
+        """
+        filtro, params = self._filtro()
+        sql   = SELECT_LISTA + filtro
+        ordem = self._ordem() + " LIMIT ?"
+
+        if self.sort_col is None:
+            # LIMIT inicio, quantidade: o limite fica sempre no ultimo parametro
+            return [(sql + self._ordem() + " LIMIT ?, ?",
+                     params + [carregados, limite])]
+
+        if ultima is None:
+            return [(sql + ordem, params + [limite])]
+
+        col   = self._coluna()
+        valor = ultima[COLUNAS.index(self.sort_col)]
+        lid   = ultima[0]
+        if self._fixa():
+            # So o id continua; com o range na coluna fixa, sem estatisticas
+            # o SQLite escolheria o indice errado e ordenaria a parte
+            return [(sql + " AND l.id {} ?".format("<" if self.sort_rev else ">")
+                     + ordem, params + [lid, limite])]
+        nulos     = sql + " AND {} IS NULL AND l.id {} ?".format(
+            col, "<" if self.sort_rev else ">") + ordem
+        todos_nulos = sql + " AND {} IS NULL".format(col) + ordem
+        nao_nulos = sql + " AND {} IS NOT NULL".format(col) + ordem
+
+        if not self.sort_rev:
+            if valor is None:
+                return [(nulos, params + [lid, limite]),
+                        (nao_nulos, params + [limite])]
+            return [(sql + " AND {0} >= ? AND ({0}, l.id) > (?, ?)".format(col)
+                     + ordem, params + [valor, valor, lid, limite])]
+
+        if valor is None:
+            return [(nulos, params + [lid, limite])]
+        consultas = [(sql + " AND {0} <= ? AND ({0}, l.id) < (?, ?)".format(col)
+                      + ordem, params + [valor, valor, lid, limite])]
+        if self.sort_col not in COLUNAS_OBRIGATORIAS:
+            consultas.append((todos_nulos, params + [limite]))
+        return consultas
+
+    def buscar_pagina(self, con, ultima=None, carregados=0,
+                      limite=TAMANHO_PAGINA):
+        """Roda as consultas de pagina() ate completar `limite` linhas."""
+        rows = []
+        for sql, params in self.pagina(ultima, carregados, limite):
+            params[-1] = limite - len(rows)
+            rows += executar(con, sql, params).fetchall()
+            if len(rows) >= limite:
+                break
+        return rows
+
+class ListaLivros:
+    """Linhas da lista (COLUNAS_LISTA) guardadas por coluna.
+
+    Titulo e autor vao em UTF-8 para um buffer unico, so acrescentado, e a
+    linha guarda onde comecam e os tamanhos; genero e editora, que se
+    repetem muito, viram codigos numa tabela. Ids, anos, lido e notas ficam
+    em arrays de tipo fixo. Assim nao ha um objeto Python por valor: cerca
+    de 70 bytes por linha, um decimo das tuplas completas. Indexar devolve
+    a tupla da linha, entao a lista substitui uma list de linhas (len, [i],
+    insert, del, extend). O texto das linhas apagadas so sai do buffer
+    quando a lista e recriada (a cada recarga da janela).
+    """
+
+    _SEM_ANO  = -2 ** 31
+    _SEM_LIDO = -128
+    # Tipos dos arrays, na ordem de _valores(); os estreitos crescem ao
+    # receber um valor que nao cabe (_AMPLIAR)
+    _TIPOS    = ("q", "I", "H", "H", "B", "i", "H", "b", "d")
+    _AMPLIAR  = {"B": "H", "H": "I", "I": "Q", "b": "h", "h": "i", "i": "q"}
+
+    def __init__(self, rows=()):
+        self._colunas = [array(t) for t in self._TIPOS]
+        self._ids     = self._colunas[0]
+        self._texto   = bytearray()
+        self._tabela  = [None]        # codigo -> genero/editora; 0 e None
+        self._codigos = {None: 0}
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, i):
+        c = self._colunas
+        texto, tabela = self._texto, self._tabela
+        inicio = c[1][i]
+        meio   = inicio + c[2][i]
+        ano, lido, nota = c[5][i], c[7][i], c[8][i]
+        return (c[0][i], texto[inicio:meio].decode(),
+                texto[meio:meio + c[3][i]].decode(), tabela[c[4][i]],
+                None if ano == self._SEM_ANO else ano, tabela[c[6][i]],
+                None if lido == self._SEM_LIDO else lido,
+                None if nota != nota else nota)   # NaN marca nota vazia
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __delitem__(self, i):
+        for coluna in self._colunas:
+            del coluna[i]
+
+    def _codigo(self, valor):
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            codigo = self._codigos[valor] = len(self._tabela)
+            self._tabela.append(valor)
+        return codigo
+
+    def _valores(self, row):
+        lid, titulo, autor, genero, ano, editora, lido, nota = row[:8]
+        inicio   = len(self._texto)
+        titulo   = titulo.encode("utf-8")
+        autor    = autor.encode("utf-8")
+        self._texto += titulo
+        self._texto += autor
+        return (lid, inicio, len(titulo), len(autor), self._codigo(genero),
+                self._SEM_ANO if ano is None else ano, self._codigo(editora),
+                self._SEM_LIDO if lido is None else lido,
+                float("nan") if nota is None else nota)
+
+    def _gravar(self, valores, i=None):
+        for k, valor in enumerate(valores):
+            coluna = self._colunas[k]
+            while True:
+                try:
+                    if i is None:
+                        coluna.append(valor)
+                    else:
+                        coluna.insert(i, valor)
+                    break
+                except OverflowError:
+                    coluna = self._colunas[k] = array(
+                        self._AMPLIAR[coluna.typecode], coluna)
+
+    def insert(self, i, row):
+        self._gravar(self._valores(row), i)
+
+    def append(self, row):
+        self._gravar(self._valores(row))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def indice(self, lid):
+        """Posicao do livro `lid`, ou None."""
+        try:
+            return self._ids.index(lid)
+        except ValueError:
+            return None
+
+# Tabela de traducao que imita o COLLATE NOCASE (so A-Z viram minusculas)
+_NOCASE = {c: c + 32 for c in range(ord("A"), ord("Z") + 1)}
+
+def executar(con, sql, params=()):
+    """con.execute para as consultas geradas pela Consulta. No modo
+    DIAGNOSTICO_PLANOS registra antes o EXPLAIN QUERY PLAN."""
+    if DIAGNOSTICO_PLANOS:
+        registrar_plano(con, sql, params)
+    return con.execute(sql, params)
+
+def registrar_plano(con, sql, params=()):
+    """Guarda o plano da consulta em PLANOS e no log "biblioteca.planos".
+
+    Planos que ordenam numa B-tree temporaria saem como aviso. Devolve a
+    lista de passos do plano.
+    """
+    passos = [r[3] for r in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    PLANOS[sql] = passos
+    log_planos.log(logging.WARNING if plano_com_ordenacao(passos) else logging.INFO,
+                   "%s\n    %s", sql, "\n    ".join(passos))
+    return passos
+
+def plano_com_ordenacao(passos):
+    """True se o plano ordena o resultado a parte em vez de ler um indice
+    na ordem. Uma varredura sem sort (p.ex. pelo rowid quando a coluna
+    ordenada e fixada pelo filtro) e escolha de custo do planejador."""
+    return any("TEMP B-TREE" in p for p in passos)
+
+def verificar_planos(con=None):
+    """Gera as consultas da lista para toda combinacao de ordenacao e
+    filtro (sem busca textual) e devolve as que precisam de ordenacao
+    temporaria, como pares (sql, passos)."""
+    con = con or get_connection()
+    problemas = []
+    for col in COLUNAS_ORDENACAO:
+        amostra = list(range(len(COLUNAS)))
+        # Continuar de um NULL so acontece nas colunas que aceitam NULL
+        for valor in (1,) if col in COLUNAS_OBRIGATORIAS else (None, 1):
+            ultima = amostra[:]
+            ultima[0] = 1
+            ultima[COLUNAS.index(col)] = valor
+            for rev in (False, True):
+                for genero in (None, GENEROS[0]):
+                    for lido in (None, True):
+                        c = Consulta("", genero, lido, col, rev)
+                        consultas = c.pagina() + c.pagina(ultima) + [c.sql()]
+                        for sql, params in consultas:
+                            passos = registrar_plano(con, sql, params)
+                            if plano_com_ordenacao(passos):
+                                problemas.append((sql, passos))
+    return problemas
+
+# ── Medicao ───────────────────────────────────────────────────────────────────
+
+class Registro:
+    """Fases de uma operacao (uma atualizacao da lista, p.ex.): nome ->
+    [segundos, linhas]. `inicio` marca quando a operacao comecou."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.fases  = {}
+
+    def somar(self, fase, segundos, linhas=0):
+        f = self.fases.get(fase)
+        if f is None:
+            self.fases[fase] = [segundos, linhas]
+        else:
+            f[0] += segundos
+            f[1] += linhas
+
+    def segundos(self, prefixo=""):
+        return sum(f[0] for nome, f in self.fases.items()
+                   if nome.startswith(prefixo))
+
+    def decorrido(self):
+        return time.perf_counter() - self.inicio
+
+
+class Medicao:
+    """Tempos e linhas por fase (sql.execute, sql.fetch, tree.insert, ...).
+
+    `totais` acumula desde o inicio do programa, como fase -> [vezes,
+    segundos, linhas]. O Registro ativo na thread (registrando()) recebe
+    tambem as fases da operacao em curso. O que passar de `limite_ms` vai
+    para o log "biblioteca.lentas", com o SQL e os parametros. O custo por
+    chamada e um perf_counter e uma soma num dict.
+    """
+
+    def __init__(self, limite_ms=LIMITE_LENTO_MS):
+        self.limite_ms = limite_ms
+        self.totais    = {}
+        self._trava    = threading.Lock()
+        self._local    = threading.local()
+
+    def registrar(self, fase, segundos, linhas=0, sql=None, params=None):
+        with self._trava:
+            t = self.totais.get(fase)
+            if t is None:
+                t = self.totais[fase] = [0, 0.0, 0]
+            t[0] += 1
+            t[1] += segundos
+            t[2] += linhas
+        registro = getattr(self._local, "registro", None)
+        if registro is not None:
+            registro.somar(fase, segundos, linhas)
+        if segundos * 1000 >= self.limite_ms:
+            params = repr(params) if params is not None else ""
+            log_lentas.warning("%s %.1f ms, %d linha(s): %s %s", fase,
+                               segundos * 1000, linhas, sql or "",
+                               params if len(params) <= 300 else params[:297] + "...")
+
+    @contextmanager
+    def fase(self, nome, linhas=0):
+        inicio = time.perf_counter()
+        yield
+        self.registrar(nome, time.perf_counter() - inicio, linhas)
+
+    @contextmanager
+    def registrando(self, registro=None):
+        """Ativa `registro` (ou um novo) nesta thread enquanto durar o bloco."""
+        registro  = registro or Registro()
+        anterior  = getattr(self._local, "registro", None)
+        self._local.registro = registro
+        try:
+            yield registro
+        finally:
+            self._local.registro = anterior
+
+    def resumo(self):
+        with self._trava:
+            return {fase: {"vezes": v, "segundos": s, "linhas": n}
+                    for fase, (v, s, n) in self.totais.items()}
+
+MEDICAO = Medicao()
+
+def ativar_log_lentas(arquivo=ARQUIVO_LENTAS, max_bytes=1 << 20, copias=3):
+    """Grava as operacoes lentas em `arquivo`, que gira ao passar de
+    `max_bytes` mantendo `copias` antigas."""
+    handler = logging.handlers.RotatingFileHandler(
+        arquivo, maxBytes=max_bytes, backupCount=copias, encoding="utf-8",
+        delay=True)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(threadName)s %(message)s"))
+    log_lentas.addHandler(handler)
+    return handler
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que passa o tempo de execute e dos fetch para a MEDICAO.
+    Iterar o cursor direto (for row in cur) nao e medido."""
+
+    def execute(self, sql, params=()):
+        inicio = time.perf_counter()
+        super().execute(sql, params)
+        self._sql = sql
+        MEDICAO.registrar("sql.execute", time.perf_counter() - inicio, 0, sql, params)
+        return self
+
+    def executemany(self, sql, seq):
+        inicio = time.perf_counter()
+        super().executemany(sql, seq)
+        MEDICAO.registrar("sql.executemany", time.perf_counter() - inicio,
+                          max(self.rowcount, 0), sql)
+        return self
+
+    def executescript(self, script):
+        inicio = time.perf_counter()
+        super().executescript(script)
+        MEDICAO.registrar("sql.executescript", time.perf_counter() - inicio,
+                          0, script)
+        return self
+
+    def _buscar(self, metodo, *args):
+        inicio = time.perf_counter()
+        rows = metodo(*args)
+        MEDICAO.registrar("sql.fetch", time.perf_counter() - inicio,
+                          len(rows), getattr(self, "_sql", None))
+        return rows
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        MEDICAO.registrar("sql.fetch", time.perf_counter() - inicio,
+                          row is not None, getattr(self, "_sql", None))
+        return row
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._buscar(super().fetchmany)
+        return self._buscar(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._buscar(super().fetchall)
+
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexao cujos atalhos execute* e commit passam pela MEDICAO."""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        super().commit()
+        MEDICAO.registrar("sql.commit", time.perf_counter() - inicio)
+
+# Aplicados a cada conexao nova. journal_mode=WAL fica gravado no arquivo e
+# deixa leitores (a thread de busca, p.ex.) trabalharem durante uma escrita.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",      # 256 MB
+    "PRAGMA cache_size=-65536",        # 64 MB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+_local = threading.local()
+
+def get_connection(arquivo=None):
+    """Conexao persistente da thread atual com `arquivo` (DB_FILE se None),
+    aberta e configurada uma vez.
+
+    Nao feche a conexao devolvida; use fechar_conexao() ao encerrar a thread.
+    Ela fica em modo autocommit: agrupe escritas com `with transacao()`.
+    O cache de statements do sqlite3 evita recompilar as consultas repetidas.
+    Execucoes, fetch e commits sao medidos (ConexaoMedida).
+    """
+    arquivo = arquivo or DB_FILE
+    conexoes = getattr(_local, "conexoes", None)
+    if conexoes is None:
+        conexoes = _local.conexoes = {}
+    con = conexoes.get(arquivo)
+    if con is None:
+        con = conexoes[arquivo] = abrir_conexao(arquivo)
+    return con
+
+def abrir_conexao(arquivo=None, somente_leitura=False, compartilhada=False):
+    """Conexao nova com `arquivo`, configurada como as de get_connection().
+
+    Quem abre fecha. `somente_leitura` recusa gravacoes (PRAGMA query_only);
+    `compartilhada` deixa usar a conexao em outras threads, uma por vez
+    (p.ex. num pool).
+    """
+    con = sqlite3.connect(arquivo or DB_FILE, isolation_level=None,
+                          cached_statements=256, factory=ConexaoMedida,
+                          check_same_thread=not compartilhada)
+    con.create_function("chave_livro", 2, chave_livro, deterministic=True)
+    for pragma in PRAGMAS:
+        con.execute(pragma)
+    if somente_leitura:
+        con.execute("PRAGMA query_only=1")
+    return con
+
+def fechar_conexao():
+    """Fecha as conexoes abertas pela thread atual."""
+    conexoes = getattr(_local, "conexoes", None) or {}
+    while conexoes:
+        _, con = conexoes.popitem()
+        con.execute("PRAGMA optimize")  # atualiza estatisticas dos indices
+        con.close()
+
+@contextmanager
+def transacao(arquivo=None, marcar=True):
+    """Transacao na conexao da thread: commit no fim, rollback se der erro.
+
+    Dentro de outra transacao vira um SAVEPOINT, entao pode ser aninhada.
+    Com marcar=False o commit nao avanca a geracao de escrita: serve para
+    o que nao muda os livros (so pegar a trava, gravar uma marca), sem
+    descartar o CacheConsultas.
+    """
+    con = get_connection(arquivo)
+    if con.in_transaction:
+        con.execute("SAVEPOINT aninhada")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK TO aninhada")
+            con.execute("RELEASE aninhada")
+            raise
+        con.execute("RELEASE aninhada")
+        return
+
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    con.commit()
+    if marcar:
+        marcar_escrita()
+
+_escritas      = count(1)
+_ultima_escrita = 0
+
+def marcar_escrita():
+    """Avanca a geracao de escrita do processo (feito por transacao())."""
+    global _ultima_escrita
+    _ultima_escrita = next(_escritas)
+
+def geracao_escrita():
+    return _ultima_escrita
+
+
+# ── Generos ───────────────────────────────────────────────────────────────────
+
+GENEROS = [
+    "Ficção Científica", "Fantasia", "Romance", "Terror/Horror",
+    "Mistério/Policial", "Aventura", "Biografia", "História",
+    "Filosofia", "Ciência", "Tecnologia", "Autoajuda",
+    "Negócios", "Arte", "Poesia", "Infantil", "Infanto-juvenil", "Outros"
+]
+
+# Outros nomes aceitos na importacao, comparados sem caixa nem acentos e so
+# como palavra inteira ("art" nao casa com "smart")
+SINONIMOS_GENERO = {
+    "sci-fi":          "Ficção Científica",
+    "scifi":           "Ficção Científica",
+    "science fiction": "Ficção Científica",
+    "ficcao cientifica": "Ficção Científica",
+    "fantasy":         "Fantasia",
+    "horror":          "Terror/Horror",
+    "terror":          "Terror/Horror",
+    "mystery":         "Mistério/Policial",
+    "misterio":        "Mistério/Policial",
+    "policial":        "Mistério/Policial",
+    "crime":           "Mistério/Policial",
+    "thriller":        "Mistério/Policial",
+    "suspense":        "Mistério/Policial",
+    "detective":       "Mistério/Policial",
+    "adventure":       "Aventura",
+    "biography":       "Biografia",
+    "memoir":          "Biografia",
+    "memorias":        "Biografia",
+    "history":         "História",
+    "philosophy":      "Filosofia",
+    "science":         "Ciência",
+    "technology":      "Tecnologia",
+    "programming":     "Tecnologia",
+    "computacao":      "Tecnologia",
+    "self-help":       "Autoajuda",
+    "self help":       "Autoajuda",
+    "auto-ajuda":      "Autoajuda",
+    "business":        "Negócios",
+    "economia":        "Negócios",
+    "art":             "Arte",
+    "poetry":          "Poesia",
+    "children":        "Infantil",
+    "kids":            "Infantil",
+    "young adult":     "Infanto-juvenil",
+    "juvenil":         "Infanto-juvenil",
+    "ya":              "Infanto-juvenil",
+}
+
+
+class _Automato:
+    """Aho-Corasick: acha todas as ocorrencias de varios padroes numa
+    unica passada pelo texto."""
+
+    def __init__(self, padroes):
+        self.transicoes = [{}]
+        self.falha      = [0]
+        self.saidas     = [[]]
+        for padrao in padroes:
+            no = 0
+            for c in padrao:
+                prox = self.transicoes[no].get(c)
+                if prox is None:
+                    prox = len(self.transicoes)
+                    self.transicoes.append({})
+                    self.falha.append(0)
+                    self.saidas.append([])
+                    self.transicoes[no][c] = prox
+                no = prox
+            self.saidas[no].append(padrao)
+
+        fila = deque(self.transicoes[0].values())
+        while fila:
+            no = fila.popleft()
+            for c, prox in self.transicoes[no].items():
+                fila.append(prox)
+                f = self.falha[no]
+                while f and c not in self.transicoes[f]:
+                    f = self.falha[f]
+                destino = self.transicoes[f].get(c, 0)
+                self.falha[prox]  = destino if destino != prox else 0
+                self.saidas[prox] = self.saidas[prox] + self.saidas[self.falha[prox]]
+
+    def buscar(self, texto):
+        """Gera (inicio, padrao) para cada ocorrencia em `texto`."""
+        no = 0
+        for i, c in enumerate(texto):
+            while no and c not in self.transicoes[no]:
+                no = self.falha[no]
+            no = self.transicoes[no].get(c, 0)
+            for padrao in self.saidas[no]:
+                yield i - len(padrao) + 1, padrao
+
+
+class ClassificadorGenero:
+    """Mapeia o genero escrito num CSV para um item de GENEROS.
+
+    Mesma regra do mapeamento original, mas sem caixa e sem acentos: vence o
+    primeiro genero da lista cujo nome contem o valor ou esta contido nele.
+    Os sinonimos contam como nomes do genero, quando aparecem como palavra.
+    Tudo e pre-calculado na criacao e o resultado de cada valor distinto fica
+    num cache LRU de `tamanho_cache` entradas.
+    """
+
+    def __init__(self, generos=GENEROS, sinonimos=SINONIMOS_GENERO,
+                 tamanho_cache=4096, padrao="Outros"):
+        self.generos = list(generos)
+        self.padrao  = padrao
+        prioridade   = {g: i for i, g in enumerate(self.generos)}
+
+        # padrao normalizado -> (prioridade, exige palavra inteira)
+        self._padroes = {}
+        for g in self.generos:
+            self._padroes[_normalizar_texto(g)] = (prioridade[g], False)
+        for sinonimo, g in sinonimos.items():
+            chave = _normalizar_texto(sinonimo)
+            if chave not in self._padroes:
+                self._padroes[chave] = (prioridade[g], True)
+        self._exatos   = {p: self.generos[i] for p, (i, _) in self._padroes.items()}
+        self._automato = _Automato(self._padroes)
+
+        # "valor contido no nome": um find() sobre todos os nomes juntos, na
+        # ordem da lista, devolve o primeiro genero que contem o valor
+        nomes = [_normalizar_texto(g) for g in self.generos]
+        self._nomes   = "\x00".join(nomes)
+        self._inicios = []
+        pos = 0
+        for nome in nomes:
+            self._inicios.append(pos)
+            pos += len(nome) + 1
+
+        self.classificar = lru_cache(maxsize=tamanho_cache)(self._classificar)
+
+    def _classificar(self, valor):
+        v = _normalizar_texto(valor or "")
+        if not v:
+            return self.padrao
+        if v in self._exatos:
+            return self._exatos[v]
+
+        melhor = len(self.generos)
+        for inicio, padrao in self._automato.buscar(v):
+            prioridade, palavra = self._padroes[padrao]
+            if palavra and not _palavra_inteira(v, inicio, inicio + len(padrao)):
+                continue
+            melhor = min(melhor, prioridade)
+
+        pos = self._nomes.find(v)
+        if pos >= 0:
+            melhor = min(melhor, bisect_right(self._inicios, pos) - 1)
+
+        return self.generos[melhor] if melhor < len(self.generos) else self.padrao
+
+def _palavra_inteira(texto, inicio, fim):
+    return ((inicio == 0 or not texto[inicio - 1].isalnum()) and
+            (fim == len(texto) or not texto[fim].isalnum()))
+
+CLASSIFICADOR_GENERO = ClassificadorGenero()
+
+def _mapear_genero(valor):
+    return CLASSIFICADOR_GENERO.classificar(valor)
+
+# ── Importacao CSV ────────────────────────────────────────────────────────────
+
+CAMPOS_IMPORTACAO = ("titulo", "autor", "genero", "ano", "editora",
+                     "lido", "nota", "obs")
+
+# Nomes de coluna de CSV reconhecidos para cada campo (detectar_coluna)
+SINONIMOS_COLUNA = {
+    "titulo": ["titulo", "title", "nome", "name", "livro", "book"],
+    "autor":  ["autor", "author", "escritor", "writer"],
+    "genero": ["genero", "genre", "categoria", "category", "tipo"],
+    "ano":    ["ano", "year", "ano_publicacao", "published"],
+    "editora":["editora", "publisher", "editora/publisher"],
+    "lido":   ["lido", "read", "lido?", "ja lido", "concluido"],
+    "nota":   ["nota", "rating", "avaliacao", "score", "pontuacao"],
+    "obs":    ["obs", "observacoes", "notes", "notas", "comentarios"],
+}
+
+def detectar_coluna(campo, colunas):
+    """Primeira coluna do CSV cujo nome contem um sinonimo de `campo`, ou None."""
+    for col in colunas:
+        for syn in SINONIMOS_COLUNA.get(campo, []):
+            if syn in col.lower().replace(" ", "_"):
+                return col
+    return None
+
+def mapa_automatico(colunas):
+    """Mapa campo -> coluna (ou None) de importar_csv(), por detectar_coluna."""
+    return {campo: detectar_coluna(campo, colunas) for campo in CAMPOS_IMPORTACAO}
+
+AMOSTRA_DETECCAO = 64 * 1024   # bytes do inicio usados para detectar o formato
+BLOCO_LEITURA    = 1 << 20     # bytes decodificados por vez ao ler o mapeamento
+DELIMITADORES    = ",;\t|"
+
+_INDEFINIDOS_CP1252 = frozenset(b"\x81\x8d\x8f\x90\x9d")
+
+def _erro_cp1252(erro):
+    """Tratador de erro de decodificacao: bytes que nao sao UTF-8 valido sao
+    lidos como cp1252 (latin-1 nos cinco que o cp1252 nao define). Assim um
+    arquivo UTF-8 com um acento latin-1 perdido no meio ainda e importado."""
+    trecho = bytes(erro.object[erro.start:erro.end])
+    texto = "".join(chr(b) if b in _INDEFINIDOS_CP1252 else bytes((b,)).decode("cp1252")
+                    for b in trecho)
+    return texto, erro.end
+
+codecs.register_error("biblioteca-cp1252", _erro_cp1252)
+
+class FormatoCSV(namedtuple("FormatoCSV", "encoding delimitador aspas")):
+    """Encoding, delimitador e aspas de um CSV, como detectar_csv() acha."""
+
+    def parametros(self):
+        """Argumentos de formato para csv.reader/DictReader."""
+        return {"delimiter": self.delimitador, "quotechar": self.aspas}
+
+    def codec(self):
+        """(codec, bytes do BOM a pular) para ler o mapeamento."""
+        if self.encoding == "utf-8-sig":
+            return "utf-8", len(codecs.BOM_UTF8)
+        return self.encoding, 0
+
+FORMATO_PADRAO = FormatoCSV("utf-8", ",", '"')
+
+@contextmanager
+def _mapear(path):
+    """O arquivo mapeado em memoria como memoryview (b"" se vazio)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as vista:
+                yield vista
+
+def detectar_csv(path):
+    """Detecta o FormatoCSV pelo inicio do arquivo.
+
+    Encoding: BOM UTF-8, senao UTF-8 se a amostra validar no decodificador
+    incremental (um caractere cortado no fim da amostra nao conta como
+    erro), senao cp1252. Delimitador e aspas: csv.Sniffer sobre as linhas
+    completas da amostra, conferido com o cabecalho. Bytes invalidos depois da amostra nao impedem a
+    leitura (ver _erro_cp1252).
+    """
+    with _mapear(path) as vista:
+        with vista[:AMOSTRA_DETECCAO] as bloco:
+            amostra = bytes(bloco)
+    if amostra.startswith(codecs.BOM_UTF8):
+        encoding, amostra = "utf-8-sig", amostra[len(codecs.BOM_UTF8):]
+    else:
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(amostra)
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "cp1252"
+    texto = codecs.decode(amostra, "utf-8" if encoding == "utf-8-sig" else encoding,
+                          "biblioteca-cp1252")
+    if len(amostra) == AMOSTRA_DETECCAO and "\n" in texto:
+        texto = texto[:texto.rindex("\n") + 1]
+    try:
+        dialeto = csv.Sniffer().sniff(texto, DELIMITADORES)
+        delimitador, aspas = dialeto.delimiter, dialeto.quotechar or '"'
+    except csv.Error:
+        delimitador, aspas = FORMATO_PADRAO.delimitador, FORMATO_PADRAO.aspas
+    # O Sniffer se engana com campos entre aspas que contem quebras de linha;
+    # um delimitador que nem aparece no cabecalho nao pode estar certo
+    cabecalho = texto.split("\n", 1)[0]
+    if delimitador not in cabecalho:
+        delimitador = max(DELIMITADORES, key=cabecalho.count)
+        if delimitador not in cabecalho:
+            delimitador = FORMATO_PADRAO.delimitador
+    return FormatoCSV(encoding, delimitador, aspas)
+
+def linhas_mapeadas(path, formato, inicio=0, fim=None, posicao=None):
+    """Gera as linhas de texto (com o "\n") dos bytes `inicio`:`fim` do
+    arquivo, decodificando o mapeamento em blocos com um decodificador
+    incremental, sem ler o arquivo para a memoria. `posicao`, se dado, e uma
+    lista cujo primeiro item acompanha o byte ja decodificado."""
+    codec, bom = formato.codec()
+    decodificador = codecs.getincrementaldecoder(codec)("biblioteca-cp1252")
+    with _mapear(path) as vista:
+        fim = len(vista) if fim is None else fim
+        resto = ""
+        for pos in range(max(inicio, bom), fim, BLOCO_LEITURA):
+            with vista[pos:min(pos + BLOCO_LEITURA, fim)] as bloco:
+                linhas = (resto + decodificador.decode(bloco)).split("\n")
+            if posicao is not None:
+                posicao[0] = min(pos + BLOCO_LEITURA, fim)
+            resto = linhas.pop()
+            for linha in linhas:
+                yield linha + "\n"
+        resto += decodificador.decode(b"", final=True)
+        if resto:
+            yield resto
+
+def ler_csv(path, formato=None, posicao=None):
+    """Gera as linhas do CSV como dicts, lendo o arquivo mapeado em memoria;
+    sem `formato`, ele e detectado."""
+    formato = formato or detectar_csv(path)
+    yield from csv.DictReader(linhas_mapeadas(path, formato, posicao=posicao),
+                              **formato.parametros())
+
+def amostra_csv(path, n):
+    """(formato, colunas, primeiras `n` linhas) para a previa da importacao."""
+    formato = detectar_csv(path)
+    linhas = linhas_mapeadas(path, formato)
+    try:
+        leitor = csv.DictReader(linhas, **formato.parametros())
+        return formato, leitor.fieldnames or [], list(islice(leitor, n))
+    finally:
+        linhas.close()
+
+def em_lotes(iteravel, tamanho):
+    it = iter(iteravel)
+    while True:
+        lote = list(islice(it, tamanho))
+        if not lote:
+            return
+        yield lote
+
+def valor_csv(row, col):
+    if not col:
+        return None
+    return (row.get(col) or "").strip() or None
+
+def normalizar_linha(row, mapa):
+    """Converte uma linha do CSV na tupla gravada em livros (INSERT_LIVRO).
+
+    `mapa` liga cada campo de CAMPOS_IMPORTACAO a uma coluna do CSV (ou None).
+    Devolve None se faltar titulo ou autor.
+    """
+    titulo = valor_csv(row, mapa.get("titulo"))
+    autor  = valor_csv(row, mapa.get("autor"))
+    if not titulo or not autor:
+        return None
+
+    genero_raw = valor_csv(row, mapa.get("genero"))
+    genero = _mapear_genero(genero_raw) if genero_raw else "Outros"
+
+    ano_raw = valor_csv(row, mapa.get("ano"))
+    try:
+        ano = int(ano_raw) if ano_raw else None
+    except ValueError:
+        ano = None
+
+    editora = valor_csv(row, mapa.get("editora"))
+
+    lido_raw = valor_csv(row, mapa.get("lido"))
+    if lido_raw:
+        lido = 1 if lido_raw.lower() in ("sim", "yes", "true", "1", "x", "v") else 0
+    else:
+        lido = 0
+
+    nota_raw = valor_csv(row, mapa.get("nota"))
+    try:
+        nota = float(nota_raw.replace(",", ".")) if nota_raw else None
+        if nota is not None and not (0 <= nota <= 10):
+            nota = None
+    except ValueError:
+        nota = None
+
+    obs = valor_csv(row, mapa.get("obs"))
+
+    return (titulo, autor, genero, ano, editora, lido, nota, obs,
+            chave_livro(titulo, autor))
+
+INSERT_LIVRO = ("INSERT INTO livros "
+                "(titulo,autor,genero,ano,editora,lido,nota,obs,chave) "
+                "VALUES (?,?,?,?,?,?,?,?,?)")
+
+def chaves_existentes(con, chaves):
+    """Subconjunto de `chaves` que ja esta gravado (consulta em blocos pelo
+    indice da chave)."""
+    chaves = list(chaves)
+    achadas = set()
+    for i in range(0, len(chaves), 500):
+        bloco = chaves[i:i + 500]
+        achadas.update(r[0] for r in con.execute(
+            "SELECT chave FROM livros WHERE chave IN ({})".format(
+                ",".join("?" * len(bloco))), bloco))
+    return achadas
+
+def _lotes_sequenciais(path, formato, mapa):
+    """Gera (registros, erros, bytes_lidos, linhas) lendo o CSV em stream."""
+    posicao = [0]
+    for lote in em_lotes(ler_csv(path, formato, posicao), TAMANHO_LOTE):
+        regs = [normalizar_linha(row, mapa) for row in lote]
+        validos = [r for r in regs if r is not None]
+        yield validos, len(regs) - len(validos), posicao[0], len(lote)
+
+def _fim_do_cabecalho(path, aspas='"'):
+    """Posicao do primeiro byte depois da linha de cabecalho."""
+    trechos = _limites_registros(path, 0, 1, maximo=1, aspas=aspas)
+    return trechos[0][1] if trechos else 0
+
+def _limites_registros(path, inicio, tamanho, maximo=None, aspas='"'):
+    """Divide o arquivo em trechos de ~`tamanho` bytes terminados em fim de
+    registro: a primeira quebra de linha depois do alvo fora de aspas.
+
+    Basta a paridade das aspas desde `inicio`, porque no CSV padrao uma aspa
+    dentro de campo vem dobrada (""). Os bytes de aspa e de quebra de linha
+    sao os mesmos em UTF-8, latin-1 e cp1252. Devolve pares (inicio, fim).
+    """
+    aspa = aspas.encode("ascii")
+    trechos = []
+    with open(path, "rb") as f:
+        f.seek(inicio)
+        base   = inicio
+        ini    = inicio
+        alvo   = inicio + tamanho
+        aberto = False   # ha aspas abertas na posicao atual
+        while maximo is None or len(trechos) < maximo:
+            bloco = f.read(1 << 22)
+            if not bloco:
+                break
+            k = 0
+            while maximo is None or len(trechos) < maximo:
+                if base + k < alvo:
+                    lim = min(len(bloco), alvo - base)
+                    aberto ^= bloco.count(aspa, k, lim) % 2 == 1
+                    k = lim
+                    if k == len(bloco):
+                        break
+                nl = bloco.find(b"\n", k)
+                if nl == -1:
+                    aberto ^= bloco.count(aspa, k) % 2 == 1
+                    break
+                aberto ^= bloco.count(aspa, k, nl) % 2 == 1
+                k = nl + 1
+                if not aberto:
+                    trechos.append((ini, base + k))
+                    ini  = base + k
+                    alvo = ini + tamanho
+            base += len(bloco)
+    if ini < base and (maximo is None or len(trechos) < maximo):
+        trechos.append((ini, base))
+    return trechos
+
+def _processar_trecho(path, formato, inicio, fim, colunas, mapa):
+    """Le e normaliza os registros entre os bytes `inicio` e `fim`.
+
+    Roda nos processos do pool; devolve (registros, erros, linhas).
+    """
+    regs = [normalizar_linha(row, mapa)
+            for row in csv.DictReader(linhas_mapeadas(path, formato, inicio, fim),
+                                      fieldnames=colunas, **formato.parametros())]
+    validos = [r for r in regs if r is not None]
+    return validos, len(regs) - len(validos), len(regs)
+
+def _lotes_paralelos(path, formato, mapa, processos=None):
+    """Como _lotes_sequenciais, mas normalizando trechos do arquivo num pool
+    de processos. Os trechos sao entregues na ordem do arquivo, com no maximo
+    dois por processo em andamento."""
+    fim_cab = _fim_do_cabecalho(path, formato.aspas)
+    colunas = next(csv.reader(linhas_mapeadas(path, formato, 0, fim_cab),
+                              **formato.parametros()), [])
+
+    processos = processos or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(processos,
+                               mp_context=multiprocessing.get_context("spawn"))
+    pendentes = deque()
+    try:
+        for ini, fim in _limites_registros(path, fim_cab, TAMANHO_TRECHO,
+                                           aspas=formato.aspas):
+            pendentes.append((fim, pool.submit(_processar_trecho, path, formato,
+                                               ini, fim, colunas, mapa)))
+            if len(pendentes) < 2 * processos:
+                continue
+            fim_trecho, futuro = pendentes.popleft()
+            yield from _dividir_trecho(futuro.result(), fim_trecho)
+        while pendentes:
+            fim_trecho, futuro = pendentes.popleft()
+            yield from _dividir_trecho(futuro.result(), fim_trecho)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _dividir_trecho(resultado, fim):
+    """Quebra o resultado de um trecho em lotes de TAMANHO_LOTE para gravar."""
+    registros, erros, linhas = resultado
+    for i in range(0, max(len(registros), 1), TAMANHO_LOTE):
+        primeiro = i == 0
+        yield (registros[i:i + TAMANHO_LOTE], erros if primeiro else 0,
+               fim, linhas if primeiro else 0)
+
+def importar_csv(path, formato, mapa, ignorar_duplicados=True,
+                 progresso=None, cancelado=None, paralelo=None, arquivo=None):
+    """Importa o CSV em lotes de TAMANHO_LOTE linhas, lendo-o como stream.
+
+    O arquivo e mapeado em memoria e decodificado aos blocos; `formato` e o
+    FormatoCSV de detectar_csv() (detectado aqui se None).
+
+    Cada lote e gravado com executemany numa transacao propria, entao uma
+    importacao cancelada (`cancelado` e um threading.Event) mantem os lotes
+    ja concluidos. `progresso(bytes_lidos, linhas_lidas)` e chamado a cada
+    lote. Devolve um dict com os totais e o maior id anterior a importacao.
+
+    Duplicatas sao achadas pela chave normalizada: contra o banco, um lote
+    por vez pelo indice; dentro do arquivo, num set em memoria. Com o indice
+    unico (CHAVE_UNICA) o proprio INSERT ... ON CONFLICT DO NOTHING descarta.
+
+    Arquivos a partir de LIMITE_PARALELO bytes (ou com paralelo=True) sao
+    normalizados num pool de processos; a gravacao continua sendo feita por
+    esta thread, na ordem do arquivo, com o mesmo resultado da leitura
+    sequencial.
+    """
+    if paralelo is None:
+        paralelo = (os.path.getsize(path) >= LIMITE_PARALELO
+                    and (os.cpu_count() or 1) > 1)
+    formato = formato or detectar_csv(path)
+    if paralelo:
+        lotes = _lotes_paralelos(path, formato, mapa)
+    else:
+        lotes = _lotes_sequenciais(path, formato, mapa)
+
+    con = get_connection(arquivo)
+    res = {"inseridos": 0, "ignorados": 0, "erros": 0, "cancelado": False,
+           "ultimo_id": con.execute(
+               "SELECT COALESCE(MAX(id), 0) FROM livros").fetchone()[0]}
+    unica  = chave_unica(con)
+    insert = INSERT_LIVRO + " ON CONFLICT(chave) DO NOTHING" if unica else INSERT_LIVRO
+    vistos = set()
+    lidas  = 0
+
+    try:
+        for registros, erros, posicao, linhas in lotes:
+            if cancelado is not None and cancelado.is_set():
+                res["cancelado"] = True
+                break
+
+            res["erros"] += erros
+            if ignorar_duplicados and not unica:
+                gravadas = chaves_existentes(con, {r[8] for r in registros})
+                novos = []
+                for reg in registros:
+                    if reg[8] in vistos or reg[8] in gravadas:
+                        continue
+                    vistos.add(reg[8])
+                    novos.append(reg)
+                res["ignorados"] += len(registros) - len(novos)
+                registros = novos
+
+            with transacao(arquivo):
+                cur = con.executemany(insert, registros)
+            res["inseridos"] += cur.rowcount if unica else len(registros)
+            if unica:
+                res["ignorados"] += len(registros) - cur.rowcount
+            lidas += linhas
+            if progresso:
+                progresso(posicao, lidas)
+    finally:
+        lotes.close()
+
+    return res
+
+# ── Exportacao CSV ────────────────────────────────────────────────────────────
+
+CABECALHO_EXPORTACAO = ["Titulo", "Autor", "Genero", "Ano", "Editora",
+                        "Lido", "Nota", "Observacoes", "Cadastrado em"]
+
+def exportar_csv(path, consulta=None, progresso=None, cancelado=None,
+                 arquivo=None):
+    """Grava em `path` os livros da consulta (todos, se None), em stream.
+
+    As linhas vao do cursor direto para o csv.writer em blocos de
+    TAMANHO_LOTE, entao a memoria nao cresce com o tamanho da biblioteca. O
+    arquivo e escrito com outro nome e so renomeado no fim; se `cancelado`
+    for sinalizado, ele e apagado. Devolve o numero de livros exportados, ou
+    None se cancelado.
+    """
+    consulta = consulta or Consulta()
+    con = get_connection(arquivo)
+    total = executar(con, *consulta.contagem()).fetchone()[0]
+    sql, params = consulta.sql(
+        "l.titulo,l.autor,l.genero,l.ano,l.editora,l.lido,l.nota,l.obs,l.criado_em")
+    return _escrever_csv(path, CABECALHO_EXPORTACAO, executar(con, sql, params),
+                         _linha_exportacao, total, progresso, cancelado)
+
+def _linha_exportacao(r):
+    """Linha do CSV para (titulo, autor, genero, ano, editora, lido, nota,
+    obs, criado_em)."""
+    return [r[0], r[1], r[2], r[3] or "", r[4] or "",
+            "Sim" if r[5] else "Nao",
+            r[6] if r[6] is not None else "", r[7] or "", r[8]]
+
+def _escrever_csv(path, cabecalho, cur, linha, total, progresso, cancelado):
+    """Escreve as linhas de `cur`, convertidas por `linha(row)`, em `path`.
+
+    O arquivo e escrito com outro nome e so renomeado no fim; se `cancelado`
+    for sinalizado, ele e apagado e o resultado e None. Senao devolve o
+    numero de linhas escritas.
+    """
+    parcial = path + ".parcial"
+    feitos  = 0
+    try:
+        with open(parcial, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.writer(f)
+            w.writerow(cabecalho)
+            while True:
+                rows = cur.fetchmany(TAMANHO_LOTE)
+                if not rows:
+                    break
+                if cancelado is not None and cancelado.is_set():
+                    cur.close()
+                    os.remove(parcial)
+                    return None
+                w.writerows(linha(r) for r in rows)
+                feitos += len(rows)
+                if progresso:
+                    progresso(feitos, total)
+        os.replace(parcial, path)
+    except BaseException:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        raise
+    return feitos
+
+# Exportacao incremental: "gravado" para livros inseridos ou alterados (com
+# todos os campos), "removido" para lapides (so id, titulo e autor)
+CABECALHO_ALTERACOES = (["Operacao", "Id"] + CABECALHO_EXPORTACAO
+                        + ["Alterado em (UTC)"])
+
+_ALTERACOES = """
+    SELECT 'gravado', id, titulo, autor, genero, ano, editora, lido, nota, obs,
+           criado_em, atualizado_em AS momento
+    FROM livros WHERE atualizado_em >= ?1 AND atualizado_em < ?2
+    UNION ALL
+    SELECT 'removido', id, titulo, autor, NULL, NULL, NULL, NULL, NULL, NULL,
+           NULL, removido_em AS momento
+    FROM livros_removidos WHERE removido_em >= ?1 AND removido_em < ?2
+    ORDER BY momento
+"""
+
+def marca_exportacao(destino, arquivo=None):
+    """Ate onde (exclusive) as alteracoes ja foram exportadas para `destino`
+    ("" se nunca)."""
+    row = get_connection(arquivo).execute(
+        "SELECT marca FROM marcas_exportacao WHERE destino=?", (destino,)).fetchone()
+    return row[0] if row else ""
+
+def exportar_alteracoes(path, destino="padrao", progresso=None, cancelado=None,
+                        arquivo=None):
+    """Grava em `path` so o que mudou desde a ultima exportacao para `destino`.
+
+    Sai o intervalo [marca guardada, corte): livros por atualizado_em e
+    lapides por removido_em, numa so consulta (uma leitura consistente) em
+    ordem de momento, pelos indices dessas colunas. O corte e lido com a
+    trava de escrita, entao nenhuma gravacao esta em andamento: tudo antes
+    dele ja foi confirmado, e o que vier depois tera momento >= corte e sai
+    na proxima vez. A marca so avanca para o corte depois que o arquivo foi
+    escrito e renomeado; a primeira exportacao leva tudo. Sem nada no
+    intervalo a marca fica onde estava, e a exportacao nao grava no banco.
+    Devolve {"gravados", "removidos", "marca"} ou None se cancelado.
+    """
+    marca = marca_exportacao(destino, arquivo)
+    with transacao(arquivo, marcar=False) as con:   # so le: o cache continua
+        corte = con.execute("SELECT " + AGORA_UTC).fetchone()[0]
+    total = con.execute(
+        "SELECT (SELECT COUNT(*) FROM livros"
+        "        WHERE atualizado_em >= ?1 AND atualizado_em < ?2)"
+        " + (SELECT COUNT(*) FROM livros_removidos"
+        "    WHERE removido_em >= ?1 AND removido_em < ?2)",
+        (marca, corte)).fetchone()[0]
+
+    res = {"gravados": 0, "removidos": 0, "marca": corte}
+    def linha(r):
+        if r[0] == "removido":
+            res["removidos"] += 1
+            return [r[0], r[1], r[2], r[3]] + [""] * 7 + [r[11]]
+        res["gravados"] += 1
+        return [r[0], r[1]] + _linha_exportacao(r[2:11]) + [r[11]]
+
+    feitos = _escrever_csv(path, CABECALHO_ALTERACOES,
+                           executar(con, _ALTERACOES, (marca, corte)),
+                           linha, total, progresso, cancelado)
+    if feitos is None:
+        return None
+    if not feitos:
+        return res   # [marca, corte) vazio: a marca antiga equivale ao corte
+    with transacao(arquivo, marcar=False) as con:
+        con.execute(
+            "INSERT INTO marcas_exportacao (destino, marca, exportado_em) "
+            "VALUES (?, ?, {0}) ON CONFLICT(destino) DO UPDATE SET "
+            "marca = excluded.marca, exportado_em = excluded.exportado_em"
+            .format(AGORA_UTC), (destino, corte))
+    return res
+
+# ── Copias de seguranca ───────────────────────────────────────────────────────
+
+PASTA_COPIAS      = "copias"  # ao lado do banco, para as copias agendadas
+COPIAS_MANTIDAS   = 7         # copias agendadas guardadas; as mais velhas saem
+INTERVALO_COPIAS  = 24 * 3600 # segundos entre copias agendadas
+PAGINAS_POR_PASSO = 256       # paginas copiadas por passo da API de backup
+PAUSA_COPIA       = 0.01      # segundos entre passos
+REINICIOS_COPIA   = 5         # reinicios tolerados antes de copiar num passo so
+
+log_copias = logging.getLogger("biblioteca.copias")
+
+class _CopiaReiniciada(Exception):
+    pass
+
+def _backup(con, destino, passo, progresso, cancelado):
+    """con.backup() para `destino` em passos de `passo` paginas, pausando
+    PAUSA_COPIA entre eles. Levanta _CopiaReiniciada se o SQLite recomecar a
+    copia mais de REINICIOS_COPIA vezes."""
+    estado = {"restantes": None, "reinicios": 0}
+    def passo_feito(_status, restantes, total):
+        if estado["restantes"] is not None and restantes > estado["restantes"]:
+            estado["reinicios"] += 1
+            if estado["reinicios"] > REINICIOS_COPIA:
+                raise _CopiaReiniciada()
+        estado["restantes"] = restantes
+        if cancelado is not None and cancelado.is_set():
+            raise InterruptedError()
+        if progresso:
+            progresso(total - restantes, total)
+        time.sleep(PAUSA_COPIA)
+    alvo = sqlite3.connect(destino)
+    try:
+        con.backup(alvo, pages=passo, progress=passo_feito)
+    finally:
+        alvo.close()
+
+def fazer_copia(destino, compactar=False, progresso=None, cancelado=None,
+                arquivo=None):
+    """Copia consistente do banco em uso para `destino`, sem parar a janela.
+
+    Usa a API de backup do SQLite em passos de PAGINAS_POR_PASSO paginas com
+    uma pausa entre eles; cada passo so le, e no WAL leitores nao travam
+    quem grava. Gravacoes de outras conexoes fazem o SQLite recomecar a
+    copia; depois de REINICIOS_COPIA recomecos ela e feita num passo so (uma
+    leitura unica, que tambem nao trava ninguem). Com `compactar`, usa
+    VACUUM INTO: arquivo menor, sem paginas livres, mas de uma vez, sem
+    progresso nem cancelamento.
+
+    A copia e escrita com outro nome, conferida com quick_check e so entao
+    renomeada. Devolve o tamanho em bytes, ou None se cancelada.
+    """
+    con = get_connection(arquivo)
+    parcial = destino + ".parcial"
+    if os.path.exists(parcial):
+        os.remove(parcial)
+    try:
+        if compactar:
+            con.execute("VACUUM INTO ?", (parcial,))
+        else:
+            try:
+                _backup(con, parcial, PAGINAS_POR_PASSO, progresso, cancelado)
+            except _CopiaReiniciada:
+                log_copias.info("copia reiniciada %d vezes por gravacoes; "
+                                "terminando num passo so", REINICIOS_COPIA)
+                _backup(con, parcial, -1, progresso, cancelado)
+        copia = sqlite3.connect(parcial)
+        try:
+            resultado = copia.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            copia.close()
+        if resultado != "ok":
+            raise sqlite3.DatabaseError("copia com erro: " + resultado)
+        os.replace(parcial, destino)
+    except InterruptedError:
+        os.remove(parcial)
+        return None
+    except BaseException:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        raise
+    return os.path.getsize(destino)
+
+def pasta_copias(arquivo=None):
+    """Pasta das copias agendadas: PASTA_COPIAS ao lado do banco."""
+    return os.path.join(os.path.dirname(os.path.abspath(arquivo or DB_FILE)),
+                        PASTA_COPIAS)
+
+def copias_agendadas(arquivo=None):
+    """Caminhos das copias agendadas, da mais velha para a mais nova."""
+    pasta = pasta_copias(arquivo)
+    if not os.path.isdir(pasta):
+        return []
+    prefixo = os.path.splitext(os.path.basename(arquivo or DB_FILE))[0] + "_"
+    return [os.path.join(pasta, nome) for nome in sorted(os.listdir(pasta))
+            if nome.startswith(prefixo) and nome.endswith(".db")]
+
+def copia_vencida(arquivo=None, intervalo=INTERVALO_COPIAS):
+    """True se a copia agendada mais nova tem mais de `intervalo` segundos
+    (ou se nao ha nenhuma)."""
+    copias = copias_agendadas(arquivo)
+    return not copias or time.time() - os.path.getmtime(copias[-1]) > intervalo
+
+def fazer_copia_agendada(compactar=False, manter=COPIAS_MANTIDAS,
+                         progresso=None, cancelado=None, arquivo=None):
+    """Grava uma copia datada em pasta_copias() e apaga as que passarem de
+    `manter`. Devolve o caminho da copia, ou None se cancelada."""
+    arquivo = arquivo or DB_FILE
+    pasta = pasta_copias(arquivo)
+    os.makedirs(pasta, exist_ok=True)
+    nome = "{}_{}.db".format(os.path.splitext(os.path.basename(arquivo))[0],
+                             time.strftime("%Y%m%d_%H%M%S"))
+    destino = os.path.join(pasta, nome)
+    if fazer_copia(destino, compactar, progresso, cancelado, arquivo) is None:
+        return None
+    for velha in copias_agendadas(arquivo)[:-manter]:
+        os.remove(velha)
+        log_copias.info("copia antiga removida: %s", velha)
+    log_copias.info("copia agendada gravada: %s", destino)
+    return destino
+
+# ── Mescla de bibliotecas ─────────────────────────────────────────────────────
+
+# Em livros que as duas bibliotecas tem, quem vence em nota, lido e obs
+POLITICAS_MESCLA = ("meus", "deles", "recente")
+
+_DELES_VENCE = {
+    "meus":    "0",
+    "deles":   "1",
+    "recente": "d.momento > livros.atualizado_em",
+}
+
+def _escolher(campo, deles):
+    """Valor final de `campo`: o do lado vencedor, mas nota e obs vazias
+    (NULL) de um lado nao apagam as do outro."""
+    if campo == "lido":
+        return "CASE WHEN {} THEN d.lido ELSE livros.lido END".format(deles)
+    return ("CASE WHEN {0} THEN COALESCE(d.{1}, livros.{1}) "
+            "ELSE COALESCE(livros.{1}, d.{1}) END").format(deles, campo)
+
+def mesclar_biblioteca(outro, politica="meus", arquivo=None):
+    """Traz para este banco os livros do banco `outro`, tudo em SQL.
+
+    O outro arquivo e anexado (ATTACH) e, numa transacao:
+    1. cada chave (titulo + autor normalizados) dele fica com um so livro,
+       o alterado por ultimo, numa tabela temporaria (chave -> id);
+    2. livros que ja existem aqui recebem nota, lido e obs pela `politica`
+       (POLITICAS_MESCLA; "recente" compara atualizado_em) num UPDATE ...
+       FROM;
+    3. os demais entram com um INSERT ... SELECT.
+    Nada passa por Python linha a linha. Devolve as contagens {"total",
+    "repetidos" (chaves repetidas no outro), "novos", "existentes" (chaves
+    que ja havia aqui), "atualizados" (livros daqui que mudaram)}.
+    """
+    if politica not in POLITICAS_MESCLA:
+        raise ValueError("politica invalida: {}".format(politica))
+    arquivo = arquivo or DB_FILE
+    if os.path.exists(arquivo) and os.path.samefile(outro, arquivo):
+        raise ValueError("nao da para mesclar a biblioteca com ela mesma")
+
+    con = get_connection(arquivo)
+    con.execute("ATTACH DATABASE ? AS outra", (outro,))
+    try:
+        colunas = [r[1] for r in con.execute("PRAGMA outra.table_info(livros)")]
+        if not colunas:
+            raise ValueError("o arquivo nao tem uma biblioteca: {}".format(outro))
+        chave = "chave_livro(titulo, autor)"
+        if "chave" in colunas:
+            chave = "COALESCE(chave, {})".format(chave)
+        momento = "strftime('%Y-%m-%d %H:%M:%f', criado_em, 'utc')"
+        if "atualizado_em" in colunas:
+            momento = "COALESCE(atualizado_em, {})".format(momento)
+
+        with transacao(arquivo) as con:
+            con.execute("DROP TABLE IF EXISTS temp.mescla")
+            con.execute("CREATE TEMP TABLE mescla "
+                        "(chave TEXT PRIMARY KEY, id INTEGER, momento TEXT)")
+            lidos = con.execute(
+                "INSERT INTO temp.mescla (chave, id, momento) "
+                "SELECT chave, id, momento FROM ("
+                "  SELECT {0} AS chave, id, {1} AS momento, ROW_NUMBER() OVER ("
+                "    PARTITION BY {0} ORDER BY {1} DESC, id DESC) AS n"
+                "  FROM outra.livros) WHERE n = 1".format(chave, momento)).rowcount
+            total_outra = con.execute(
+                "SELECT COUNT(*) FROM outra.livros").fetchone()[0]
+
+            deles = _DELES_VENCE[politica]
+            novos = {c: _escolher(c, deles) for c in ("nota", "lido", "obs")}
+            atualizados = con.execute(
+                "UPDATE main.livros SET " +
+                ", ".join("{} = {}".format(c, v) for c, v in novos.items()) +
+                " FROM (SELECT m.chave, m.momento, COALESCE(o.lido, 0) AS lido,"
+                "              o.nota, o.obs"
+                "       FROM temp.mescla m JOIN outra.livros o ON o.id = m.id) AS d"
+                " WHERE livros.chave = d.chave AND (" +
+                " OR ".join("({}) IS NOT livros.{}".format(v, c)
+                            for c, v in novos.items()) + ")").rowcount
+
+            inseridos = con.execute(
+                "INSERT INTO main.livros (titulo, autor, genero, ano, editora,"
+                "                         lido, nota, obs, criado_em, chave) "
+                "SELECT o.titulo, o.autor, o.genero, o.ano, o.editora,"
+                "       COALESCE(o.lido, 0), o.nota, o.obs,"
+                "       COALESCE(o.criado_em, datetime('now','localtime')), m.chave "
+                "FROM temp.mescla m JOIN outra.livros o ON o.id = m.id "
+                "WHERE NOT EXISTS (SELECT 1 FROM main.livros l"
+                "                  WHERE l.chave = m.chave)").rowcount
+            con.execute("DROP TABLE temp.mescla")
+    finally:
+        con.execute("DETACH DATABASE outra")
+
+    return {"total": total_outra, "repetidos": total_outra - lidos,
+            "novos": inseridos, "existentes": lidos - inseridos,
+            "atualizados": atualizados}
+
+# ── Cache de consultas ────────────────────────────────────────────────────────
+
+class CacheConsultas:
+    """Resultados de consultas em LRU, limitados a `limite_bytes` estimados.
+
+    Tudo e descartado quando os dados mudam: a geracao de escrita do
+    processo (transacao()) pega as gravacoes deste programa, e o PRAGMA
+    data_version de cada conexao, as feitas por outras conexoes e outros
+    programas. Uma conexao vista pela primeira vez tambem descarta, porque
+    nao da para saber o que mudou antes dela.
+    """
+
+    def __init__(self, limite_bytes=LIMITE_CACHE_BYTES):
+        self.limite_bytes = limite_bytes
+        self.bytes   = 0
+        self._itens  = OrderedDict()   # chave -> (valor, bytes)
+        self._trava  = threading.Lock()
+        self._vistas = weakref.WeakKeyDictionary()  # conexao -> data_version
+        self._externas = 0
+        self._geracao  = None
+
+    def geracao(self, con):
+        """Geracao atual dos dados vista por `con`; muda a cada gravacao.
+
+        Numa transacao aberta (o pool do servidor, p.ex.) o PRAGMA pode fixar
+        o instante da leitura antes de outra conexao contar uma gravacao;
+        entao vale a geracao tomada antes dele, que nunca e mais nova que os
+        dados lidos depois. Chame antes da primeira leitura da transacao.
+        """
+        with self._trava:
+            antes = (geracao_escrita(), self._externas)
+        versao = con.execute("PRAGMA data_version").fetchone()[0]
+        with self._trava:
+            if self._vistas.get(con) != versao:
+                self._vistas[con] = versao
+                self._externas += 1
+            geracao = (geracao_escrita(), self._externas)
+            if geracao != self._geracao:
+                self._itens.clear()
+                self.bytes = 0
+                self._geracao = geracao
+        # Fora de transacao cada leitura seguinte ja ve tudo o que foi contado
+        return antes if con.in_transaction else geracao
+
+    def obter(self, con, chave):
+        self.geracao(con)
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            self._itens.move_to_end(chave)
+            return item[0]
+
+    def guardar(self, chave, valor, geracao, linhas=()):
+        """Guarda `valor` se os dados ainda estao na `geracao` em que ele foi
+        lido. `linhas` sao as tuplas do valor, usadas para estimar o tamanho."""
+        tamanho = sum(sys.getsizeof(r) + sum(map(sys.getsizeof, r)) for r in linhas)
+        with self._trava:
+            if geracao != self._geracao or tamanho > self.limite_bytes:
+                return
+            antigo = self._itens.pop(chave, None)
+            if antigo is not None:
+                self.bytes -= antigo[1]
+            self._itens[chave] = (valor, tamanho)
+            self.bytes += tamanho
+            while self.bytes > self.limite_bytes:
+                _, (_, t) = self._itens.popitem(last=False)
+                self.bytes -= t
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+            self.bytes = 0
+
+# ── Repositorio ───────────────────────────────────────────────────────────────
+
+# Um livro lido do banco; os campos seguem COLUNAS, entao livro[6] == livro.lido
+Livro = namedtuple("Livro", COLUNAS)
+
+# Campos que alterar_varios() regrava de uma vez em varios livros
+CAMPOS_EM_MASSA = ("genero", "lido", "nota")
+
+class RepositorioLivros:
+    """Acesso aos livros de um arquivo de banco, sem nada de interface.
+
+    Cada thread usa a propria conexao (get_connection), entao o mesmo
+    repositorio serve a janela, as threads de trabalho e scripts. As listas
+    vem como tuplas na ordem de COLUNAS; obter() devolve um Livro. Gravacoes
+    que violam o indice unico da chave levantam sqlite3.IntegrityError.
+    """
+
+    def __init__(self, arquivo=None, cache=None):
+        self.arquivo = arquivo or DB_FILE
+        self.cache   = cache or CacheConsultas()
+
+    def conexao(self):
+        return get_connection(self.arquivo)
+
+    def transacao(self):
+        return transacao(self.arquivo)
+
+    def iniciar(self):
+        """Cria ou atualiza o esquema do banco."""
+        init_db(self.arquivo)
+
+    # Leitura
+
+    def pagina(self, consulta, ultima=None, carregados=0, limite=TAMANHO_PAGINA):
+        """Ate `limite` linhas da `consulta` depois de `ultima` (keyset)."""
+        return consulta.buscar_pagina(self.conexao(), ultima, carregados, limite)
+
+    def primeira_pagina(self, consulta, limite=TAMANHO_PAGINA):
+        """(linhas, totais) do inicio da `consulta`, do cache se os dados nao
+        mudaram desde a ultima vez."""
+        chave = consulta.identidade() + (limite,)
+        con = self.conexao()
+        geracao = self.cache.geracao(con)
+        achado = self.cache.obter(con, chave)
+        if achado is not None:
+            MEDICAO.registrar("cache.acerto", 0.0, len(achado[0]))
+            return achado
+        resultado = (self.pagina(consulta, limite=limite), self.totais(consulta))
+        self.cache.guardar(chave, resultado, geracao, resultado[0])
+        return resultado
+
+    def em_cache(self, consulta, limite=TAMANHO_PAGINA):
+        """True se primeira_pagina(consulta) sairia do cache."""
+        return self.cache.obter(self.conexao(),
+                                consulta.identidade() + (limite,)) is not None
+
+    def totais(self, consulta):
+        """(total, lidos) dos livros que passam pela `consulta`. Sem busca
+        textual vem dos contadores de resumo_genero, sem contar linhas."""
+        if not consulta.expr:
+            return contagem_resumo(self.conexao(), consulta.genero, consulta.lido)
+        return executar(self.conexao(), *consulta.contagem()).fetchone()
+
+    def resumo(self):
+        """Totais da biblioteca e de cada genero, de resumo_genero.
+
+        {"total", "lidos", "nota_media", "generos": {genero: {"total",
+        "lidos", "nota_media"}}}; nota_media e None sem livros com nota.
+        """
+        generos = {}
+        soma, com_nota = 0.0, 0
+        for genero, total, lidos, s, n in self.conexao().execute(
+                "SELECT genero, total, lidos, soma_nota, com_nota "
+                "FROM resumo_genero WHERE total > 0"):
+            generos[genero] = {"total": total, "lidos": lidos,
+                               "nota_media": s / n if n else None}
+            soma += s
+            com_nota += n
+        return {"total": sum(g["total"] for g in generos.values()),
+                "lidos": sum(g["lidos"] for g in generos.values()),
+                "nota_media": soma / com_nota if com_nota else None,
+                "generos": generos}
+
+    def verificar_resumo(self):
+        return verificar_resumo(self.arquivo)
+
+    def reconstruir_resumo(self):
+        reconstruir_resumo(self.arquivo)
+
+    def consultar(self, consulta, colunas="l.*", tamanho=TAMANHO_LOTE):
+        """Gera todas as linhas da `consulta`, buscando `tamanho` por vez."""
+        cur = executar(self.conexao(), *consulta.sql(colunas))
+        try:
+            while True:
+                rows = cur.fetchmany(tamanho)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
+
+    def filtrado(self, consulta, lid):
+        """O livro `lid` se ele passar pela `consulta`, senao None."""
+        return executar(self.conexao(), *consulta.por_id(lid)).fetchone()
+
+    def obter(self, lid):
+        row = self.conexao().execute("SELECT * FROM livros WHERE id=?",
+                                     (lid,)).fetchone()
+        return Livro(*row) if row is not None else None
+
+    def ids_apos(self, ultimo_id, limite=None):
+        """Ids gravados depois de `ultimo_id` (p.ex. por uma importacao)."""
+        sql, params = "SELECT id FROM livros WHERE id > ? ORDER BY id", [ultimo_id]
+        if limite is not None:
+            sql += " LIMIT ?"
+            params.append(limite)
+        return [r[0] for r in self.conexao().execute(sql, params)]
+
+    # Escrita
+
+    def inserir(self, titulo, autor, genero, ano=None, editora=None, lido=0,
+                nota=None, obs=None):
+        """Grava um livro novo e devolve o id."""
+        with self.transacao() as con:
+            cur = con.execute(INSERT_LIVRO,
+                              (titulo, autor, genero, ano, editora, int(lido),
+                               nota, obs, chave_livro(titulo, autor)))
+        return cur.lastrowid
+
+    def atualizar(self, lid, titulo, autor, genero, ano=None, editora=None,
+                  lido=0, nota=None, obs=None):
+        """Regrava todos os campos do livro `lid`; True se ele existia."""
+        with self.transacao() as con:
+            cur = con.execute(
+                "UPDATE livros SET titulo=?,autor=?,genero=?,ano=?,editora=?,"
+                "lido=?,nota=?,obs=?,chave=? WHERE id=?",
+                (titulo, autor, genero, ano, editora, int(lido), nota, obs,
+                 chave_livro(titulo, autor), lid))
+        return cur.rowcount > 0
+
+    def remover(self, lid):
+        """Apaga o livro `lid`; True se ele existia."""
+        with self.transacao() as con:
+            cur = con.execute("DELETE FROM livros WHERE id=?", (lid,))
+        return cur.rowcount > 0
+
+    def inserir_varios(self, registros):
+        """Grava numa transacao tuplas (titulo, autor, genero, ano, editora,
+        lido, nota, obs), como as de normalizar_linha(); a chave e calculada
+        aqui. Devolve quantos gravou."""
+        registros = [tuple(r[:8]) + (chave_livro(r[0], r[1]),) for r in registros]
+        with self.transacao() as con:
+            con.executemany(INSERT_LIVRO, registros)
+        return len(registros)
+
+    # Em massa: `alvo` e uma lista de ids ou uma Consulta, que vale por todos
+    # os livros que passam por ela (carregados na lista ou nao)
+
+    def _em_massa(self, sql, valores, alvo):
+        """Roda `sql` nos livros de `alvo` numa so transacao: um comando com
+        subconsulta para uma Consulta, executemany para ids. Devolve quantos
+        livros mudaram."""
+        with self.transacao() as con:
+            if isinstance(alvo, Consulta):
+                filtro, params = alvo.ids()
+                cur = executar(con, sql + " WHERE id IN (" + filtro + ")",
+                               list(valores) + params)
+            else:
+                cur = con.executemany(sql + " WHERE id=?",
+                                      [tuple(valores) + (lid,) for lid in alvo])
+        return cur.rowcount
+
+    def remover_varios(self, alvo):
+        """Apaga os livros de `alvo`; devolve quantos eram."""
+        return self._em_massa("DELETE FROM livros", (), alvo)
+
+    def alterar_varios(self, alvo, **campos):
+        """Regrava `campos` (genero, lido, nota) nos livros de `alvo`, p.ex.
+        alterar_varios(ids, lido=True). Devolve quantos livros mudaram."""
+        invalidos = set(campos) - set(CAMPOS_EM_MASSA)
+        if invalidos or not campos:
+            raise ValueError("campos invalidos: {}".format(
+                ", ".join(sorted(invalidos)) or "nenhum"))
+        if "lido" in campos:
+            campos["lido"] = int(campos["lido"])
+        sql = "UPDATE livros SET " + ", ".join(c + "=?" for c in campos)
+        return self._em_massa(sql, campos.values(), alvo)
+
+    # CSV
+
+    def importar(self, path, formato, mapa, ignorar_duplicados=True,
+                 progresso=None, cancelado=None, paralelo=None):
+        """importar_csv() neste banco."""
+        return importar_csv(path, formato, mapa, ignorar_duplicados,
+                            progresso, cancelado, paralelo, self.arquivo)
+
+    def exportar(self, path, consulta=None, progresso=None, cancelado=None):
+        """exportar_csv() deste banco."""
+        return exportar_csv(path, consulta, progresso, cancelado, self.arquivo)
+
+    def exportar_alteracoes(self, path, destino="padrao", progresso=None,
+                            cancelado=None):
+        """exportar_alteracoes() deste banco."""
+        return exportar_alteracoes(path, destino, progresso, cancelado,
+                                   self.arquivo)
+
+    def marca_exportacao(self, destino="padrao"):
+        return marca_exportacao(destino, self.arquivo)
+
+    def mesclar(self, outro, politica="meus"):
+        """mesclar_biblioteca() para este banco."""
+        return mesclar_biblioteca(outro, politica, self.arquivo)
+
+    # Copias de seguranca
+
+    def copiar(self, destino, compactar=False, progresso=None, cancelado=None):
+        """fazer_copia() deste banco."""
+        return fazer_copia(destino, compactar, progresso, cancelado, self.arquivo)
+
+    def copia_vencida(self, intervalo=INTERVALO_COPIAS):
+        return copia_vencida(self.arquivo, intervalo)
+
+    def fazer_copia_agendada(self, compactar=False, manter=COPIAS_MANTIDAS,
+                             progresso=None, cancelado=None):
+        """fazer_copia_agendada() deste banco."""
+        return fazer_copia_agendada(compactar, manter, progresso, cancelado,
+                                    self.arquivo)
+
+# ── Linha de comando ──────────────────────────────────────────────────────────
+#
+# python biblioteca_dados.py [--db ARQUIVO] import|export|query|stats|vacuum ...
+# Roda sem tkinter e sem tela (p.ex. em tarefas agendadas num servidor).
+# Saida: 0 ok, 1 erro, 2 uso invalido, 130 interrompido.
+
+def _genero_cli(valor):
+    """Tipo do argparse para --genero: aceita o nome sem acento nem caixa."""
+    alvo = _normalizar_texto(valor)
+    for genero in GENEROS:
+        if _normalizar_texto(genero) == alvo:
+            return genero
+    raise argparse.ArgumentTypeError(
+        "genero desconhecido: {} (use um de: {})".format(valor, ", ".join(GENEROS)))
+
+def _consulta_cli(args):
+    """Consulta com os filtros da linha de comando (os mesmos da lista)."""
+    return Consulta(args.busca, args.genero,
+                    {"sim": True, "nao": False}.get(args.lido),
+                    args.ordem, args.desc)
+
+def _progresso_cli(formato):
+    """progresso(...) que reescreve uma linha no stderr, se for um terminal."""
+    if not sys.stderr.isatty():
+        return None
+    def progresso(*valores):
+        sys.stderr.write("\r" + formato.format(*valores))
+        sys.stderr.flush()
+    return progresso
+
+def _fim_progresso(progresso):
+    if progresso is not None:
+        sys.stderr.write("\n")
+
+def _cli_import(repo, args):
+    formato = detectar_csv(args.csv)
+    colunas = next(csv.reader(linhas_mapeadas(args.csv, formato),
+                              **formato.parametros()), [])
+    mapa = {} if args.sem_auto else mapa_automatico(colunas)
+    for campo in CAMPOS_IMPORTACAO:
+        col = getattr(args, campo)
+        if col is not None:
+            if col not in colunas:
+                raise ValueError("coluna inexistente no CSV: {}".format(col))
+            mapa[campo] = col
+    if not mapa.get("titulo") or not mapa.get("autor"):
+        raise ValueError("informe as colunas de titulo e autor (--titulo, --autor)")
+    print("{}: {}, separador {!r}; {}".format(
+        args.csv, formato.encoding, formato.delimitador,
+        ", ".join("{}={}".format(c, mapa[c]) for c in CAMPOS_IMPORTACAO
+                  if mapa.get(c))), file=sys.stderr)
+
+    progresso = _progresso_cli("{1} linhas lidas")
+    res = repo.importar(args.csv, formato, mapa, not args.duplicados, progresso)
+    _fim_progresso(progresso)
+    print("{inseridos} importado(s), {ignorados} duplicado(s) ignorado(s), "
+          "{erros} linha(s) sem titulo/autor".format(**res), file=sys.stderr)
+    return 0
+
+def _cli_export(repo, args):
+    progresso = _progresso_cli("{0} de {1} livros")
+    if args.alteracoes:
+        res = repo.exportar_alteracoes(args.csv, args.destino, progresso)
+        _fim_progresso(progresso)
+        print("{gravados} gravado(s) e {removidos} removido(s) ate {marca} UTC"
+              .format(**res), file=sys.stderr)
+    else:
+        feitos = repo.exportar(args.csv, _consulta_cli(args), progresso)
+        _fim_progresso(progresso)
+        print("{} livro(s) exportado(s)".format(feitos), file=sys.stderr)
+    return 0
+
+def _cli_query(repo, args):
+    """Escreve as linhas da consulta no stdout (CSV ou TSV), em stream."""
+    w = csv.writer(sys.stdout, lineterminator="\n",
+                   delimiter="\t" if args.tsv else ",")
+    w.writerow(COLUNAS_LISTA)
+    linhas = repo.consultar(_consulta_cli(args), ", ".join(
+        "l." + c for c in COLUNAS_LISTA))
+    if args.limite is not None:
+        linhas = islice(linhas, args.limite)
+    for lote in em_lotes(linhas, TAMANHO_LOTE):
+        w.writerows(lote)
+    return 0
+
+def _cli_stats(repo, args):
+    resumo = repo.resumo()
+    if args.json:
+        json.dump(resumo, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+    def media(valor):
+        return "-" if valor is None else "{:.2f}".format(valor)
+    print("{:<22}{:>10}{:>10}{:>8}".format("genero", "livros", "lidos", "nota"))
+    for genero in GENEROS:
+        g = resumo["generos"].get(genero)
+        if g:
+            print("{:<22}{:>10}{:>10}{:>8}".format(
+                genero, g["total"], g["lidos"], media(g["nota_media"])))
+    print("{:<22}{:>10}{:>10}{:>8}".format(
+        "total", resumo["total"], resumo["lidos"], media(resumo["nota_media"])))
+    return 0
+
+def _cli_vacuum(repo, args):
+    antes = os.path.getsize(repo.arquivo)
+    if args.into:
+        depois = repo.copiar(args.into, compactar=True)
+        print("copia compactada em {}: {:.1f} MB (banco: {:.1f} MB)".format(
+            args.into, depois / 1e6, antes / 1e6), file=sys.stderr)
+        return 0
+    con = repo.conexao()
+    con.execute("VACUUM")
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    print("{:.1f} MB -> {:.1f} MB".format(
+        antes / 1e6, os.path.getsize(repo.arquivo) / 1e6), file=sys.stderr)
+    return 0
+
+def _parser_cli():
+    p = argparse.ArgumentParser(
+        prog="biblioteca_dados.py",
+        description="Biblioteca sem interface grafica: importar, exportar, "
+                    "consultar e manter o banco.")
+    p.add_argument("--db", default=DB_FILE, help="arquivo do banco (padrao: %(default)s)")
+    p.add_argument("-v", "--verboso", action="store_true", help="log no stderr")
+    sub = p.add_subparsers(dest="comando", required=True)
+
+    filtros = argparse.ArgumentParser(add_help=False)
+    filtros.add_argument("--busca", default="", help="texto, como no campo Buscar")
+    filtros.add_argument("--genero", type=_genero_cli)
+    filtros.add_argument("--lido", choices=("sim", "nao"))
+    filtros.add_argument("--ordem", choices=COLUNAS_ORDENACAO,
+                         help="coluna (padrao: titulo, ou relevancia com --busca)")
+    filtros.add_argument("--desc", action="store_true", help="ordem decrescente")
+
+    imp = sub.add_parser("import", help="importar um CSV")
+    imp.add_argument("csv")
+    for campo in CAMPOS_IMPORTACAO:
+        imp.add_argument("--" + campo, metavar="COLUNA",
+                         help="coluna do CSV para {}".format(campo))
+    imp.add_argument("--sem-auto", action="store_true",
+                     help="nao detectar colunas pelos nomes; so as informadas")
+    imp.add_argument("--duplicados", action="store_true",
+                     help="importar tambem livros que ja existem")
+
+    exp = sub.add_parser("export", parents=[filtros], help="exportar para CSV")
+    exp.add_argument("csv")
+    exp.add_argument("--alteracoes", action="store_true",
+                     help="so o que mudou desde a ultima exportacao incremental")
+    exp.add_argument("--destino", default="padrao",
+                     help="nome da marca da exportacao incremental")
+
+    qry = sub.add_parser("query", parents=[filtros],
+                         help="listar livros no stdout (CSV)")
+    qry.add_argument("--limite", type=int)
+    qry.add_argument("--tsv", action="store_true", help="separar por tabulacao")
+
+    est = sub.add_parser("stats", help="totais por genero")
+    est.add_argument("--json", action="store_true")
+
+    vac = sub.add_parser("vacuum", help="compactar o banco")
+    vac.add_argument("--into", metavar="ARQUIVO",
+                     help="gravar uma copia compactada em vez de compactar no lugar")
+    return p
+
+COMANDOS_CLI = {"import": _cli_import, "export": _cli_export,
+                "query": _cli_query, "stats": _cli_stats, "vacuum": _cli_vacuum}
+
+def main(argv=None):
+    """Ponto de entrada da linha de comando; devolve o codigo de saida."""
+    args = _parser_cli().parse_args(argv)
+    if args.verboso:
+        logging.basicConfig(level=logging.INFO)
+    if args.comando != "import" and not os.path.exists(args.db):
+        print("banco nao encontrado: {}".format(args.db), file=sys.stderr)
+        return 1
+    repo = RepositorioLivros(args.db)
+    try:
+        repo.iniciar()
+        return COMANDOS_CLI[args.comando](repo, args)
+    except KeyboardInterrupt:
+        print("\ninterrompido", file=sys.stderr)
+        return 130
+    except BrokenPipeError:
+        # Leitor do stdout fechou (p.ex. | head): sem erro na saida
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (sqlite3.Error, OSError, ValueError, csv.Error) as e:
+        print("erro: {}".format(e), file=sys.stderr)
+        return 1
+    finally:
+        fechar_conexao()
+
+if __name__ == "__main__":
+    sys.exit(main())
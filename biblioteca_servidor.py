@@ -0,0 +1,439 @@
+"""Servidor HTTP/JSON local da biblioteca, para outras ferramentas lerem e
+gravarem livros sem a janela.
+
+    python biblioteca_servidor.py [--db ARQUIVO] [--porta 8080] [--leitores 4]
+
+Leituras rodam em paralelo, cada uma numa conexao de um pool (o WAL deixa
+ler durante uma escrita); gravacoes passam todas por uma unica thread
+escritora, na ordem em que chegam. As respostas levam um ETag com o PRAGMA
+data_version: quem repete o pedido com If-None-Match recebe 304 sem o banco
+ser consultado enquanto nada mudar.
+
+    GET    /livros?busca=&genero=&lido=sim|nao&ordem=&desc=1&limite=&apos=
+    GET    /livros/<id>
+    POST   /livros            (JSON do livro; devolve 201 e o id)
+    PUT    /livros/<id>       (regrava todos os campos)
+    DELETE /livros/<id>
+    GET    /resumo
+
+Os GET tambem aceitam HEAD (mesmos cabecalhos e ETag, sem corpo).
+"""
+
+import argparse
+import base64
+import json
+import logging
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from biblioteca_dados import (COLUNAS, COLUNAS_LISTA, COLUNAS_ORDENACAO, DB_FILE,
+                              GENEROS, TAMANHO_PAGINA, Consulta, RepositorioLivros,
+                              abrir_conexao, fechar_conexao, init_db)
+
+PORTA_PADRAO   = 8080
+LEITORES       = 4                 # conexoes de leitura no pool
+LIMITE_HTTP    = 1000              # linhas maximas por pagina de /livros
+ESPERA_LEITOR  = 30                # segundos esperando uma conexao livre
+MAX_CORPO      = 1024 * 1024       # bytes aceitos no corpo de POST/PUT
+
+CAMPOS_LIVRO = ("titulo", "autor", "genero", "ano", "editora", "lido", "nota", "obs")
+
+log_servidor = logging.getLogger("biblioteca.servidor")
+
+class ErroHTTP(Exception):
+    def __init__(self, status, mensagem, cabecalhos=()):
+        super().__init__(mensagem)
+        self.status     = status
+        self.cabecalhos = cabecalhos
+
+# ── Conexoes ──────────────────────────────────────────────────────────────────
+
+class PoolLeitura:
+    """Conexoes somente leitura emprestadas uma por vez as threads.
+
+    Cada emprestimo roda numa transacao de leitura, entao a pagina e os
+    totais de um pedido vem do mesmo instante do banco.
+    """
+
+    def __init__(self, arquivo, tamanho=LEITORES):
+        self._livres = queue.LifoQueue()   # a ultima usada tem o cache quente
+        self._todas  = [abrir_conexao(arquivo, somente_leitura=True,
+                                      compartilhada=True) for _ in range(tamanho)]
+        for con in self._todas:
+            self._livres.put(con)
+        self._local = threading.local()
+
+    @contextmanager
+    def emprestar(self):
+        try:
+            con = self._livres.get(timeout=ESPERA_LEITOR)
+        except queue.Empty:
+            raise ErroHTTP(503, "servidor ocupado, tente de novo")
+        self._local.con = con
+        try:
+            con.execute("BEGIN")
+            try:
+                yield con
+            finally:
+                con.execute("COMMIT")
+        finally:
+            self._local.con = None
+            self._livres.put(con)
+
+    def atual(self):
+        """Conexao emprestada a thread atual, ou None."""
+        return getattr(self._local, "con", None)
+
+    def fechar(self):
+        for con in self._todas:
+            con.close()
+
+
+class RepositorioServidor(RepositorioLivros):
+    """RepositorioLivros que le pela conexao emprestada do pool. Fora de um
+    emprestimo (na thread escritora) usa a conexao da thread, como sempre."""
+
+    def __init__(self, arquivo, pool):
+        super().__init__(arquivo)
+        self.pool = pool
+
+    def conexao(self):
+        con = self.pool.atual()
+        return con if con is not None else super().conexao()
+
+# ── JSON ──────────────────────────────────────────────────────────────────────
+
+def livro_json(row, colunas=COLUNAS):
+    """Linha do banco como dict para o JSON (sem a chave interna)."""
+    livro = dict(zip(colunas, row))
+    livro.pop("chave", None)
+    if livro.get("lido") is not None:
+        livro["lido"] = bool(livro["lido"])
+    return livro
+
+def campos_livro(dados):
+    """Argumentos de inserir()/atualizar() a partir do JSON de um livro, com
+    as mesmas regras do formulario. Levanta ValueError se algo nao vale."""
+    if not isinstance(dados, dict):
+        raise ValueError("esperado um objeto JSON")
+    desconhecidos = set(dados) - set(CAMPOS_LIVRO)
+    if desconhecidos:
+        raise ValueError("campos desconhecidos: " + ", ".join(sorted(desconhecidos)))
+
+    campos = {}
+    for campo in ("titulo", "autor", "genero", "editora", "obs"):
+        valor = dados.get(campo)
+        if valor is not None and not isinstance(valor, str):
+            raise ValueError("{} deve ser texto".format(campo))
+        campos[campo] = (valor or "").strip() or None
+    if not campos["titulo"] or not campos["autor"] or not campos["genero"]:
+        raise ValueError("titulo, autor e genero sao obrigatorios")
+    if campos["genero"] not in GENEROS:   # o formulario so deixa escolher
+        raise ValueError("genero desconhecido: " + campos["genero"])
+
+    ano = dados.get("ano")
+    if ano is not None and (not isinstance(ano, int) or isinstance(ano, bool)):
+        raise ValueError("ano deve ser numero inteiro")
+    nota = dados.get("nota")
+    if nota is not None and (not isinstance(nota, (int, float))
+                             or isinstance(nota, bool) or not 0 <= nota <= 10):
+        raise ValueError("nota deve ser numero entre 0 e 10")
+    lido = dados.get("lido", False)
+    if lido not in (True, False, 0, 1):
+        raise ValueError("lido deve ser true ou false")
+    campos.update(ano=ano, nota=nota, lido=int(lido))
+    return campos
+
+def _cursor(consulta, row, carregados):
+    """Token opaco da pagina seguinte a `row` (valor ordenado, id, posicao)."""
+    valor = row[COLUNAS.index(consulta.sort_col)] if consulta.sort_col else None
+    texto = json.dumps([valor, row[0], carregados], ensure_ascii=False)
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii")
+
+def _inteiro(valor):
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+def _ler_cursor(consulta, token):
+    """(ultima, carregados) para Consulta.pagina() a partir de _cursor()."""
+    try:
+        valor, lid, carregados = json.loads(base64.urlsafe_b64decode(token))
+    except (ValueError, TypeError):
+        raise ValueError("parametro apos invalido")
+    # Os valores vao como parametros do SQL: so tipos que o sqlite3 aceita
+    if (isinstance(valor, bool) or not isinstance(valor, (str, int, float, type(None)))
+            or not _inteiro(lid) or not _inteiro(carregados) or carregados < 0):
+        raise ValueError("parametro apos invalido")
+    ultima = [None] * len(COLUNAS)
+    ultima[0] = lid
+    if consulta.sort_col:
+        ultima[COLUNAS.index(consulta.sort_col)] = valor
+    return ultima, carregados
+
+def _consulta(parametros):
+    """Consulta com os filtros da query string (os mesmos da lista e da CLI)."""
+    def um(nome, padrao=None):
+        return parametros.get(nome, [padrao])[-1]
+    genero = um("genero")
+    if genero is not None and genero not in GENEROS:
+        raise ValueError("genero desconhecido: " + genero)
+    lido = um("lido")
+    if lido not in (None, "sim", "nao"):
+        raise ValueError("lido deve ser sim ou nao")
+    ordem = um("ordem")
+    if ordem is not None and ordem not in COLUNAS_ORDENACAO:
+        raise ValueError("ordem deve ser uma de: " + ", ".join(COLUNAS_ORDENACAO))
+    return Consulta(um("busca", ""), genero, {"sim": True, "nao": False}.get(lido),
+                    ordem, um("desc", "0") not in ("0", "", "nao", "false"))
+
+# ── Pedidos ───────────────────────────────────────────────────────────────────
+
+class ManipuladorHTTP(BaseHTTPRequestHandler):
+    """Um pedido: GETs leem pelo pool, o resto vai para a thread escritora."""
+
+    server_version   = "Biblioteca/1"
+    protocol_version = "HTTP/1.1"   # conexoes persistentes entre pedidos
+
+    ROTAS = (
+        ("GET",    re.compile(r"/livros/?$"),        "_listar"),
+        ("POST",   re.compile(r"/livros/?$"),        "_inserir"),
+        ("GET",    re.compile(r"/livros/(\d+)/?$"),  "_obter"),
+        ("PUT",    re.compile(r"/livros/(\d+)/?$"),  "_atualizar"),
+        ("DELETE", re.compile(r"/livros/(\d+)/?$"),  "_remover"),
+        ("GET",    re.compile(r"/resumo/?$"),        "_resumo"),
+    )
+
+    def do_GET(self):
+        self._despachar("GET")
+
+    def do_POST(self):
+        self._despachar("POST")
+
+    def do_PUT(self):
+        self._despachar("PUT")
+
+    def do_DELETE(self):
+        self._despachar("DELETE")
+
+    def __getattr__(self, nome):
+        # Outros metodos (PATCH, HEAD, ...) tambem passam pelas rotas e
+        # recebem 405 em JSON, em vez da pagina 501 do BaseHTTPRequestHandler
+        if nome.startswith("do_"):
+            return lambda: self._despachar(nome[3:])
+        raise AttributeError(nome)
+
+    def log_message(self, formato, *args):
+        log_servidor.info("%s " + formato, self.address_string(), *args)
+
+    def _despachar(self, metodo):
+        url = urlsplit(self.path)
+        permitidos = []
+        # HEAD responde como o GET; _responder() so deixa de mandar o corpo
+        procurado = "GET" if metodo == "HEAD" else metodo
+        try:
+            for m, rota, nome in self.ROTAS:
+                achado = rota.match(url.path)
+                if achado is None:
+                    continue
+                permitidos += [m, "HEAD"] if m == "GET" else [m]
+                if m == procurado:
+                    getattr(self, nome)(parse_qs(url.query), *achado.groups())
+                    return
+            if permitidos:
+                raise ErroHTTP(405, "use " + ", ".join(permitidos),
+                               [("Allow", ", ".join(permitidos))])
+            raise ErroHTTP(404, "caminho desconhecido: " + url.path)
+        except ErroHTTP as e:
+            self._erro(e.status, str(e), e.cabecalhos)
+        except ValueError as e:
+            self._erro(400, str(e))
+        except sqlite3.IntegrityError:
+            self._erro(409, "ja existe um livro com este titulo e autor")
+        except sqlite3.Error as e:
+            log_servidor.exception("erro no banco em %s %s", metodo, self.path)
+            self._erro(500, "erro no banco: {}".format(e))
+
+    # Respostas
+
+    def _responder(self, status, corpo=None, etag=None, cabecalhos=()):
+        dados = b""
+        if corpo is not None:
+            dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        for nome, valor in cabecalhos:
+            self.send_header(nome, valor)
+        if status != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        if dados and self.command != "HEAD":
+            self.wfile.write(dados)
+
+    def _erro(self, status, mensagem, cabecalhos=()):
+        if self.command not in ("GET", "HEAD", "DELETE") or status >= 500:
+            # O corpo pode nao ter sido lido: avisa e fecha a conexao
+            cabecalhos = list(cabecalhos) + [("Connection", "close")]
+        self._responder(status, {"erro": mensagem}, cabecalhos=cabecalhos)
+
+    def _ler(self, gerar):
+        """Responde um GET: 304 se o ETag do cliente ainda vale, senao roda
+        gerar() numa conexao do pool. O ETag e lido antes dos dados, entao
+        uma gravacao no meio so faz o cliente buscar de novo."""
+        etag = self.server.etag()
+        pedidos = self.headers.get("If-None-Match", "")
+        if any(e.strip() in (etag, "W/" + etag, "*") for e in pedidos.split(",")):
+            self._responder(304, etag=etag)
+            return
+        with self.server.repo.pool.emprestar():
+            corpo = gerar()
+        self._responder(200, corpo, etag)
+
+    def _gravar(self, funcao, *args, **kwargs):
+        """Roda funcao(...) na thread escritora e espera o resultado."""
+        return self.server.escritor.submit(funcao, *args, **kwargs).result()
+
+    def _corpo(self):
+        try:
+            tamanho = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            raise ErroHTTP(411, "informe Content-Length")
+        if tamanho > MAX_CORPO:
+            raise ErroHTTP(413, "corpo maior que {} bytes".format(MAX_CORPO))
+        try:
+            return json.loads(self.rfile.read(tamanho).decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError("JSON invalido: {}".format(e))
+
+    # Rotas
+
+    def _listar(self, parametros):
+        consulta = _consulta(parametros)
+        try:
+            limite = int(parametros.get("limite", [TAMANHO_PAGINA])[-1])
+        except ValueError:
+            raise ValueError("limite deve ser numero inteiro")
+        limite = max(1, min(limite, LIMITE_HTTP))
+        apos = parametros.get("apos", [None])[-1]
+        repo = self.server.repo
+
+        def gerar():
+            corpo = {}
+            if apos is None:
+                rows, (total, lidos) = repo.primeira_pagina(consulta, limite)
+                carregados = 0
+                corpo.update(total=total, lidos=lidos)
+            else:
+                ultima, carregados = _ler_cursor(consulta, apos)
+                rows = repo.pagina(consulta, ultima, carregados, limite)
+            corpo["livros"] = [livro_json(r, COLUNAS_LISTA) for r in rows]
+            corpo["proxima"] = (_cursor(consulta, rows[-1], carregados + len(rows))
+                                if len(rows) == limite else None)
+            return corpo
+        self._ler(gerar)
+
+    def _obter(self, parametros, lid):
+        def gerar():
+            livro = self.server.repo.obter(int(lid))
+            if livro is None:
+                raise ErroHTTP(404, "livro {} nao existe".format(lid))
+            return livro_json(livro)
+        self._ler(gerar)
+
+    def _resumo(self, parametros):
+        self._ler(self.server.repo.resumo)
+
+    def _inserir(self, parametros):
+        campos = campos_livro(self._corpo())
+        lid = self._gravar(self.server.repo.inserir, **campos)
+        self._responder(201, {"id": lid}, self.server.etag(),
+                        [("Location", "/livros/{}".format(lid))])
+
+    def _atualizar(self, parametros, lid):
+        campos = campos_livro(self._corpo())
+        if not self._gravar(self.server.repo.atualizar, int(lid), **campos):
+            raise ErroHTTP(404, "livro {} nao existe".format(lid))
+        self._responder(200, {"id": int(lid)}, self.server.etag())
+
+    def _remover(self, parametros, lid):
+        if not self._gravar(self.server.repo.remover, int(lid)):
+            raise ErroHTTP(404, "livro {} nao existe".format(lid))
+        self._responder(204, etag=self.server.etag())
+
+# ── Servidor ──────────────────────────────────────────────────────────────────
+
+class ServidorBiblioteca(ThreadingHTTPServer):
+    """Uma thread por pedido; `leitores` conexoes de leitura e uma escritora.
+
+    O ETag vem do PRAGMA data_version de uma conexao que so le: ele muda a
+    cada commit de qualquer outra conexao, seja a escritora daqui, a janela
+    ou outro programa. O momento em que o servidor subiu entra no ETag
+    porque o contador recomeca a cada conexao nova.
+    """
+
+    def __init__(self, endereco, arquivo=None, leitores=LEITORES):
+        super().__init__(endereco, ManipuladorHTTP)
+        arquivo = arquivo or DB_FILE
+        self.escritor = ThreadPoolExecutor(1, thread_name_prefix="escritor")
+        self.escritor.submit(init_db, arquivo).result()
+        self.repo = RepositorioServidor(arquivo, PoolLeitura(arquivo, leitores))
+        self._sentinela = abrir_conexao(arquivo, somente_leitura=True,
+                                        compartilhada=True)
+        self._trava  = threading.Lock()
+        self._inicio = "{:x}".format(int(time.time() * 1000))
+
+    def etag(self):
+        with self._trava:
+            versao = self._sentinela.execute("PRAGMA data_version").fetchone()[0]
+        return '"{}-{}"'.format(self._inicio, versao)
+
+    def server_close(self):
+        super().server_close()
+        self.escritor.submit(fechar_conexao).result()
+        self.escritor.shutdown()
+        self.repo.pool.fechar()
+        self._sentinela.close()
+
+def servir(arquivo=None, endereco="127.0.0.1", porta=PORTA_PADRAO,
+           leitores=LEITORES):
+    """Atende pedidos ate Ctrl+C."""
+    servidor = ServidorBiblioteca((endereco, porta), arquivo, leitores)
+    print("biblioteca {} em http://{}:{}/".format(
+        servidor.repo.arquivo, *servidor.server_address[:2]), file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="biblioteca_servidor.py",
+                                description="API HTTP/JSON local da biblioteca.")
+    p.add_argument("--db", default=DB_FILE, help="arquivo do banco (padrao: %(default)s)")
+    p.add_argument("--endereco", default="127.0.0.1",
+                   help="interface (padrao: %(default)s, so esta maquina)")
+    p.add_argument("--porta", type=int, default=PORTA_PADRAO)
+    p.add_argument("--leitores", type=int, default=LEITORES,
+                   help="conexoes de leitura em paralelo (padrao: %(default)s)")
+    p.add_argument("-v", "--verboso", action="store_true", help="log dos pedidos")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verboso else logging.WARNING)
+    try:
+        servir(args.db, args.endereco, args.porta, max(1, args.leitores))
+    except (sqlite3.Error, OSError) as e:
+        print("erro: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())